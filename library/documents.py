@@ -1,9 +1,12 @@
-from django_elasticsearch_dsl import Document
+from django_elasticsearch_dsl import Document, fields
 from django_elasticsearch_dsl.registries import registry
 from .models import Article
 
 @registry.register_document
 class ArticleDocument(Document):
+    # search_after 的 tie-breaker（見 library.es.SORT）
+    id = fields.KeywordField()
+
     class Index:
         name = 'articles'
 
@@ -13,4 +16,10 @@ class ArticleDocument(Document):
             'title',
             'content',
             'created_at',
-        ]
\ No newline at end of file
+            'updated_at',
+        ]
+        # 由 library.outbox 透過 outbox 分批更新（見 process_article_outbox），不走預設 signal
+        ignore_signals = True
+
+    def prepare_id(self, instance):
+        return str(instance.pk)
@@ -1,79 +1,125 @@
-from elasticsearch import Elasticsearch
+from django.conf import settings
+from elasticsearch import NotFoundError
+from elasticsearch.dsl.connections import connections
+from .tiptap import extract_sections, extract_text_from_tiptap
 from datetime import datetime
+import logging
+import uuid
 
-es = Elasticsearch("http://localhost:9200")
+logger = logging.getLogger(__name__)
 
+# 各種呼叫的逾時（秒），可用 settings.LIBRARY_ES_TIMEOUTS 覆寫
+TIMEOUTS = {'search': 3, 'get': 2, 'index': 10, 'bulk': 60}
 
-def search_article(query):
-    if query:
-        body = {
-            "query": {
-                "multi_match": {
-                    "query": query,
-                    "fields": ["title", "content"]
-                }
-            },
-            "sort": [
-                {"created_at": {"order": "desc"}}
-            ]
-        }
-    else:
-        body = {
-            "query": {
-                "match_all": {}
+
+def get_client(operation=None):
+    """
+    回傳 settings.ELASTICSEARCH_DSL['default'] 設定的 client：
+    第一次使用時才建立，之後跟 django_elasticsearch_dsl 共用同一個連線池；
+    指定 operation 時套用該操作的逾時
+    """
+    client = connections.get_connection('default')
+    if operation is None:
+        return client
+    timeouts = {**TIMEOUTS, **getattr(settings, 'LIBRARY_ES_TIMEOUTS', {})}
+    return client.options(request_timeout=timeouts[operation])
+
+
+# 列表只需要這些欄位，不拉整份 content / content_json
+LIST_SOURCE = ["title", "created_at"]
+SNIPPET_SIZE = 150
+# search_after 用的排序；id 是唯一的 keyword，當作同一時間的 tie-breaker
+SORT = [
+    {"created_at": {"order": "desc"}},
+    {"id": {"order": "desc", "unmapped_type": "keyword", "missing": "_last"}},
+]
+
+
+def build_search_body(query, size=20, search_after=None):
+    body = {
+        "size": size,
+        "query": {
+            "multi_match": {
+                "query": query,
+                "fields": ["title", "content"]
+            }
+        } if query else {"match_all": {}},
+        "sort": SORT,
+        "_source": {"includes": LIST_SOURCE},
+        "highlight": {
+            "fields": {
+                # 沒有命中（例如 match_all）時回傳開頭的一段
+                "content": {"fragment_size": SNIPPET_SIZE, "number_of_fragments": 1,
+                            "no_match_size": SNIPPET_SIZE},
             },
-            "sort": [
-                {"created_at": {"order": "desc"}}
-            ]
-        }
+        },
+    }
+    if search_after:
+        body["search_after"] = search_after
+    return body
 
-    res = es.search(index="articles", body=body)
+
+def search_article(query, size=20, search_after=None):
+    """
+    回傳 (結果, 下一頁的 search_after)，沒有下一頁時為 None；
+    用 search_after 分頁，不管翻到第幾頁成本都一樣，也不受 10000 筆 from 上限限制
+    """
+    body = build_search_body(query, size, search_after)
+    res = get_client('search').search(index="articles", body=body)
     hits = res["hits"]["hits"]
 
-    return [
+    results = [
         {
             "id": h["_id"],
             "title": h["_source"].get("title", ""),
-            "content": h["_source"].get("content", ""),
-            **({"content_json": h["_source"].get("content_json", {})} if not query else {}),
+            "snippet": (h.get("highlight", {}).get("content") or [""])[0],
             "created_at": h["_source"].get("created_at", ""),
         }
         for h in hits
     ]
+    next_after = hits[-1]["sort"] if len(hits) == size else None
+    return results, next_after
 
 
 def get_article_by_id(article_id):
     try:
-        res = es.get(index="articles", id=article_id)
+        res = get_client('get').get(index="articles", id=article_id,
+                                    source_includes=["title", "content_json"])
         source = res.get("_source", {})
         return {
             "title": source.get("title", ""),
             "content_json": source.get("content_json", {}),
         }
-    except Exception as e:
-        print(f"Error fetching article by id: {e}")
+    except NotFoundError:
+        return None
+    except Exception:
+        logger.exception("Failed to fetch article %s", article_id)
         return None
 
 
-def extract_text_from_tiptap(content_json):
-    if isinstance(content_json, dict):
-        if "text" in content_json:
-            return content_json["text"]
-        elif "content" in content_json:
-            return " ".join(extract_text_from_tiptap(child) for child in content_json["content"])
-    elif isinstance(content_json, list):
-        return " ".join(extract_text_from_tiptap(child) for child in content_json)
-    return ""
-
-
-def add_article(title, content_json):
+def build_article_doc(title, content_json, article_id=None, sections=False,
+                      created_at=None, updated_at=None):
+    # _id 同時存成 keyword 欄位，search_after 排序用
     doc = {
+        "id": article_id or str(uuid.uuid4()),
         "title": title,
         "content_json": content_json,
         "content": extract_text_from_tiptap(content_json),
-        "created_at": datetime.now(),
+        "created_at": created_at or datetime.now(),
     }
+    if updated_at:
+        # reconcile_articles 用來比對索引是不是最新
+        doc["updated_at"] = updated_at
+    if sections:
+        # 每個 heading 一段，可以搜尋到文章裡的小節
+        doc["sections"] = extract_sections(content_json)
+    return doc
+
 
-    res = es.index(index="articles", body=doc)
-    print(datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3])
-    return res
+def article_doc(article):
+    """Article 資料列對應的文件；沒有 content_json（例如從 admin 新增）時直接用 content"""
+    doc = build_article_doc(article.title, article.content_json or {}, str(article.pk),
+                            created_at=article.created_at, updated_at=article.updated_at)
+    if not article.content_json:
+        doc["content"] = article.content
+    return doc
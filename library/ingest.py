@@ -0,0 +1,167 @@
+import json
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from itertools import islice
+
+from django.db import connection, transaction
+from elasticsearch import helpers
+
+from .es import build_article_doc, get_client
+from .models import Article
+from .outbox import enqueue, parse_uuid
+
+INDEX = "articles"
+# 最多回報幾筆錯誤
+MAX_ERRORS = 100
+
+
+def read_articles(stream):
+    """逐行讀 NDJSON，回傳 (行號, dict 或 None)，不會把整個檔案讀進記憶體"""
+    for line_no, line in enumerate(stream, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except (ValueError, RecursionError):
+            # 巢狀太深時 json.loads 丟 RecursionError，當成格式錯誤
+            row = None
+        yield line_no, row
+
+
+def prepare_action(row, sections=False):
+    """在 worker process 裡抽出 Tiptap 文字，組成 bulk action"""
+    doc = build_article_doc(row["title"], row["content_json"], row.get("id"), sections)
+    return {"_index": INDEX, "_id": doc["id"], "_source": doc}
+
+
+@contextmanager
+def refresh_disabled(client, index=INDEX):
+    """
+    匯入期間關掉 refresh，結束後恢復原設定並 refresh 一次，
+    避免每批 bulk 都觸發 segment refresh
+    """
+    settings = client.indices.get_settings(index=index, name="index.refresh_interval")
+    original = next(iter(settings.values()), {}).get(
+        "settings", {}).get("index", {}).get("refresh_interval")
+    client.indices.put_settings(index=index, settings={"index": {"refresh_interval": "-1"}})
+    try:
+        yield
+    finally:
+        client.indices.put_settings(
+            index=index, settings={"index": {"refresh_interval": original}})
+        client.indices.refresh(index=index)
+
+
+class ArticleIngester:
+    """
+    NDJSON 的 {title, content_json, id?} 分批存成 Article 並送進 ES：
+    文字抽取在 process pool 裡做，每批先 bulk_create 資料列，
+    再用 helpers.streaming_bulk 直接送出（不經過 outbox），送失敗的才寫進 outbox 重試
+    """
+
+    def __init__(self, chunk_size=500, workers=None, client=None, sections=False):
+        self.chunk_size = chunk_size
+        self.sections = sections
+        # 0 表示在目前的 process 裡抽取（測試 / 小檔案）
+        self.workers = workers
+        self.client = client or get_client("bulk")
+        self.indexed = 0
+        self.queued = 0
+        self.errors = []
+
+    def add_error(self, **error):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(error)
+
+    def clean(self, rows):
+        for line_no, row in rows:
+            if not isinstance(row, dict):
+                self.add_error(line=line_no, error="格式錯誤")
+            elif not isinstance(row.get("title"), str) or not row["title"]:
+                self.add_error(line=line_no, error="缺少 title")
+            elif not isinstance(row.get("content_json"), (dict, list)):
+                self.add_error(line=line_no, error="缺少 content_json")
+            elif len(row["title"]) > Article._meta.get_field("title").max_length:
+                self.add_error(line=line_no, error="title 太長")
+            elif row.get("id") is not None and parse_uuid(row["id"]) is None:
+                self.add_error(line=line_no, error="id 必須是 UUID")
+            else:
+                if row.get("id") is not None:
+                    # 跟 str(Article.pk) 一致，索引的 _id 才對得上資料列
+                    row["id"] = str(parse_uuid(row["id"]))
+                yield row
+
+    def actions(self, rows, map_func):
+        # 一次只交給 pool 一批，不會把整個檔案都排進佇列
+        rows = iter(self.clean(rows))
+        while batch := list(islice(rows, self.chunk_size)):
+            actions = list(map_func(partial(prepare_action, sections=self.sections), batch))
+            self.save(actions)
+            yield from actions
+
+    def save(self, actions):
+        """
+        存成 Article 資料列；id 已存在時覆寫 title / content，created_at 保留原本的值。
+        文件裡的 created_at / updated_at 改成資料表讀回來的值，reconcile_articles 才比對得起來
+        """
+        articles = [Article(id=uuid.UUID(action["_id"]), title=action["_source"]["title"],
+                            content=action["_source"]["content"],
+                            content_json=action["_source"]["content_json"])
+                    for action in actions]
+        # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定衝突的欄位（unique_fields）
+        unique_fields = (["id"] if connection.features.supports_update_conflicts_with_target
+                         else None)
+        Article.objects.bulk_create(
+            articles, update_conflicts=True, unique_fields=unique_fields,
+            update_fields=["title", "content", "content_json", "updated_at"])
+        # 覆寫時物件上的 created_at 是這次新產生的，不是資料列裡的
+        stored = {str(pk): (created_at, updated_at) for pk, created_at, updated_at in
+                  Article.objects.filter(pk__in=[article.pk for article in articles])
+                  .values_list("pk", "created_at", "updated_at")}
+        for action in actions:
+            action["_source"]["created_at"], action["_source"]["updated_at"] = \
+                stored[action["_id"]]
+
+    def queue(self, rows):
+        """
+        只存資料列並寫進 outbox，ES 交給 process_article_outbox；
+        給 API 用，請求不等 ES。大量匯入請用 ingest_articles 指令
+        """
+        rows = iter(self.clean(rows))
+        while batch := list(islice(rows, self.chunk_size)):
+            actions = [prepare_action(row, self.sections) for row in batch]
+            with transaction.atomic():
+                self.save(actions)
+                enqueue(uuid.UUID(action["_id"]) for action in actions)
+            self.queued += len(actions)
+        return {"queued": self.queued, "errors": self.errors}
+
+    def run(self, rows):
+        with refresh_disabled(self.client):
+            if self.workers == 0:
+                self.bulk(self.actions(rows, map))
+            else:
+                with ProcessPoolExecutor(self.workers) as pool:
+                    self.bulk(self.actions(
+                        rows, lambda func, batch: pool.map(
+                            func, batch, chunksize=max(len(batch) // 16, 1))))
+        return {"indexed": self.indexed, "errors": self.errors}
+
+    def bulk(self, actions):
+        failed = []
+        for ok, item in helpers.streaming_bulk(
+                self.client, actions, chunk_size=self.chunk_size,
+                max_retries=2, raise_on_error=False, raise_on_exception=False):
+            if ok:
+                self.indexed += 1
+            else:
+                result = next(iter(item.values()))
+                failed.append(result["_id"])
+                self.add_error(id=result.get("_id"), error=str(result.get("error")))
+        if failed:
+            # 資料列已經存了，交給 process_article_outbox 重試
+            enqueue(uuid.UUID(pk) for pk in failed)
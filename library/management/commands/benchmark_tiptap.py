@@ -0,0 +1,74 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from library.tiptap import extract_text_from_tiptap
+
+
+def recursive_extract(content_json):
+    """原本的遞迴寫法，只留在這裡當比較基準"""
+    if isinstance(content_json, dict):
+        if "text" in content_json:
+            return content_json["text"]
+        elif "content" in content_json:
+            return " ".join(recursive_extract(child) for child in content_json["content"])
+    elif isinstance(content_json, list):
+        return " ".join(recursive_extract(child) for child in content_json)
+    return ""
+
+
+def wide_document(paragraphs, texts_per_paragraph):
+    """很多段落，每段有好幾個被 marks 切開的 text node"""
+    return {'type': 'doc', 'content': [
+        {'type': 'paragraph', 'content': [
+            {'type': 'text', 'text': f'word{i}-{j} '} for j in range(texts_per_paragraph)]}
+        for i in range(paragraphs)
+    ]}
+
+
+def deep_document(depth):
+    """巢狀清單，深度超過 Python 的遞迴上限"""
+    node = {'type': 'paragraph', 'content': [{'type': 'text', 'text': 'leaf'}]}
+    for _ in range(depth):
+        node = {'type': 'bulletList', 'content': [{'type': 'listItem', 'content': [node]}]}
+    return {'type': 'doc', 'content': [node]}
+
+
+class Command(BaseCommand):
+    help = '比較 Tiptap 文字抽取（遞迴 vs 迭代）在大型合成文件上的時間與記憶體'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paragraphs', type=int, default=20000)
+        parser.add_argument('--texts', type=int, default=10)
+        parser.add_argument('--depth', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def measure(self, func, document, repeat):
+        try:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(document)
+                timings.append((time.perf_counter() - start) * 1000)
+            tracemalloc.start()
+            func(document)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        except RecursionError:
+            tracemalloc.stop()
+            return 'RecursionError'
+        return f'{min(timings):10.2f} ms {peak / 1024 / 1024:10.2f} MiB peak'
+
+    def handle(self, *args, **options):
+        documents = {
+            f"wide ({options['paragraphs']} x {options['texts']})":
+                wide_document(options['paragraphs'], options['texts']),
+            f"deep ({options['depth']} levels)": deep_document(options['depth']),
+        }
+        for name, document in documents.items():
+            self.stdout.write(name)
+            for label, func in (('recursive', recursive_extract),
+                                ('iterative', extract_text_from_tiptap)):
+                self.stdout.write(
+                    f'  {label:<10} {self.measure(func, document, options["repeat"])}')
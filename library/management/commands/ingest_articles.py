@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library.ingest import ArticleIngester, read_articles
+
+
+class Command(BaseCommand):
+    help = '從 NDJSON（每行 {title, content_json}）用 bulk API 大量匯入文章到 ES'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='抽取文字的 process 數，預設為 CPU 數，0 表示不開 process')
+        parser.add_argument('--sections', action='store_true',
+                            help='同時依 heading 切段存進 sections 欄位')
+
+    def handle(self, *args, **options):
+        ingester = ArticleIngester(chunk_size=options['chunk_size'],
+                                   workers=options['workers'],
+                                   sections=options['sections'])
+        try:
+            with open(options['path'], encoding='utf-8') as stream:
+                result = ingester.run(read_articles(stream))
+        except OSError as e:
+            raise CommandError(e)
+
+        for error in result['errors']:
+            where = f"line {error['line']}" if 'line' in error else f"id {error['id']}"
+            self.stderr.write(f"{where}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {result['indexed']} indexed, {len(result['errors'])} errors"))
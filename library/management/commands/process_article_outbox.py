@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library.outbox import drain
+
+
+class Command(BaseCommand):
+    help = '持續處理 ArticleOutbox，把文章的新增 / 修改 / 刪除分批用 bulk API 同步到 ES'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='outbox 沒有資料時隔幾秒再查一次')
+        parser.add_argument('--once', action='store_true', help='處理完目前到期的項目就結束')
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                count = drain(batch_size=options['batch_size'])
+                processed += count
+                if count < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Done, {processed} processed'))
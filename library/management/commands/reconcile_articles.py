@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from library.outbox import reconcile
+
+
+class Command(BaseCommand):
+    help = '比對 Article 資料表與 ES 索引（id / updated_at），缺少或過期的文章寫進 outbox 重新同步'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--orphans', choices=['report', 'delete', 'adopt'], default='report',
+                            help='只在索引裡的文件：只回報、從索引刪除、或補成 Article 資料列')
+        parser.add_argument('--dry-run', action='store_true', help='只回報差異，不寫 outbox')
+
+    def handle(self, *args, **options):
+        counts = reconcile(batch_size=options['batch_size'], orphans=options['orphans'],
+                           dry_run=options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {counts['missing']} missing, {counts['stale']} stale, "
+            f"{counts['orphan']} orphan" + (' (dry run)' if options['dry_run'] else '')))
@@ -1,18 +1,47 @@
 import uuid
 from markdownx.models import MarkdownxField
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 
 class Article(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255)
     content = models.TextField()
+    # 編輯器（Tiptap）的原始 JSON；有值時索引的 content 由它抽出
+    content_json = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # post_save 寫的 outbox（見 library.signals）跟資料列在同一個 transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class ArticleOutbox(models.Model):
+    """
+    待同步到 ES 的文章，跟 Article 的新增 / 修改 / 刪除在同一個 transaction 寫入；
+    由 process_article_outbox 指令分批處理，處理時以資料列目前的狀態為準
+    （還在就 index、不在就 delete），所以不用記錄是哪一種操作
+    """
+    article_id = models.UUIDField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 失敗後延後重試
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['available_at', 'id'])]
+
+    def __str__(self):
+        return str(self.article_id)
+
+
 class ArticleAttachment(models.Model):
     article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name='attachments')
     file = models.FileField(upload_to='attachments/')
@@ -0,0 +1,184 @@
+"""
+Article 與 ES 索引的同步：
+寫入 Article 時在同一個 transaction 寫一筆 ArticleOutbox（見 library.signals），
+process_article_outbox 指令分批讀 outbox、用 bulk API 送出 index / delete，成功後才刪掉 outbox；
+reconcile_articles 指令比對兩邊的 id / updated_at，補上遺漏的部分
+"""
+import uuid
+from datetime import timedelta
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from elasticsearch import TransportError, helpers
+
+from .es import article_doc, get_client
+from .models import Article, ArticleOutbox
+
+INDEX = "articles"
+# 失敗後最久隔多久重試（秒）
+MAX_BACKOFF = 5 * 60
+# 存進 last_error 的長度上限
+MAX_ERROR_LENGTH = 1000
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def enqueue(article_ids):
+    """bulk_create / queryset.update() 這類不觸發 signal 的寫入，在同一個 transaction 裡自行呼叫"""
+    ArticleOutbox.objects.bulk_create(ArticleOutbox(article_id=pk) for pk in article_ids)
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(2 ** attempts, MAX_BACKOFF))
+
+
+def version(article):
+    # 用 updated_at 當 external version，兩個 worker 送出的順序顛倒時舊的內容會被 ES 拒絕
+    return int(article.updated_at.timestamp() * 1_000_000)
+
+
+def bulk_actions(article_ids):
+    """以資料列目前的狀態為準：還在就 index，已經刪掉就 delete"""
+    articles = Article.objects.in_bulk(article_ids)
+    for article_id in article_ids:
+        article = articles.get(article_id)
+        if article is None:
+            yield {"_op_type": "delete", "_index": INDEX, "_id": str(article_id)}
+        else:
+            yield {"_index": INDEX, "_id": str(article_id), "_source": article_doc(article),
+                   "_version": version(article), "_version_type": "external_gte"}
+
+
+def send(client, article_ids, chunk_size):
+    """送出 bulk，回傳 {article_id: 錯誤訊息}"""
+    errors = {}
+    for ok, item in helpers.streaming_bulk(
+            client, bulk_actions(article_ids), chunk_size=chunk_size,
+            max_retries=2, raise_on_error=False, raise_on_exception=False):
+        if ok:
+            continue
+        op_type, result = next(iter(item.items()))
+        # 要刪的文件本來就不在；409 表示索引裡已經是更新的版本
+        if (op_type == "delete" and result.get("status") == 404) or result.get("status") == 409:
+            continue
+        errors[uuid.UUID(result["_id"])] = str(result.get("error"))
+    return errors
+
+
+def drain(batch_size=500, client=None):
+    """
+    處理一批到期的 outbox，回傳處理了幾筆（含失敗的）；
+    失敗的留在 outbox，依 attempts 延後重試
+    """
+    client = client or get_client("bulk")
+    with transaction.atomic():
+        # 同時跑多個 worker 時各拿各的（MySQL 8 / PostgreSQL；SQLite 沒有 row lock）
+        entries = list(ArticleOutbox.objects.select_for_update(skip_locked=True)
+                       .filter(available_at__lte=timezone.now()).order_by("available_at", "id")
+                       [:batch_size])
+        if not entries:
+            return 0
+        # 同一篇文章連續改了好幾次只送一次
+        article_ids = list(dict.fromkeys(entry.article_id for entry in entries))
+        try:
+            errors = send(client, article_ids, batch_size)
+        except TransportError as e:
+            errors = dict.fromkeys(article_ids, str(e))
+
+        ArticleOutbox.objects.filter(
+            pk__in=[entry.pk for entry in entries if entry.article_id not in errors]).delete()
+        failed = [entry for entry in entries if entry.article_id in errors]
+        now = timezone.now()
+        for entry in failed:
+            entry.attempts += 1
+            entry.available_at = now + backoff(entry.attempts)
+            entry.last_error = errors[entry.article_id][:MAX_ERROR_LENGTH]
+        ArticleOutbox.objects.bulk_update(failed, ["attempts", "available_at", "last_error"])
+    return len(entries)
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def adopt(hits):
+    """把只存在索引裡的文件（例如舊版直接寫進 ES 的文章）補成 Article 資料列"""
+    articles = []
+    for hit in hits:
+        source = hit.get("_source", {})
+        content_json = source.get("content_json") or None
+        articles.append(Article(
+            id=uuid.UUID(hit["_id"]), title=source.get("title", "")[:255],
+            content=source.get("content", ""), content_json=content_json))
+    with transaction.atomic():
+        Article.objects.bulk_create(articles)
+        # bulk_create 會把 created_at 設成現在，改回索引裡的時間
+        for article, hit in zip(articles, hits):
+            created_at = parse_datetime(str(hit.get("_source", {}).get("created_at", "")))
+            if created_at is not None:
+                if timezone.is_naive(created_at):
+                    created_at = timezone.make_aware(created_at)
+                article.created_at = created_at
+        Article.objects.bulk_update(articles, ["created_at"])
+        enqueue(article.pk for article in articles)
+
+
+def reconcile(batch_size=1000, orphans="report", dry_run=False, client=None):
+    """
+    比對 DB 與索引，回傳 {'missing', 'stale', 'orphan'} 的數量：
+    missing / stale（updated_at 不同）寫進 outbox 重新 index；
+    orphan（只在索引裡）依 orphans 參數 'report' 只回報、'delete' 刪除、'adopt' 補成資料列。
+    兩邊都是分批走，不會把全部 id 放進記憶體
+    """
+    client = client or get_client("bulk")
+    counts = {"missing": 0, "stale": 0, "orphan": 0}
+
+    rows = Article.objects.order_by("pk").values_list("pk", "updated_at")
+    for batch in chunked(rows.iterator(chunk_size=batch_size), batch_size):
+        res = client.mget(index=INDEX, ids=[str(pk) for pk, _ in batch],
+                          source_includes=["updated_at"])
+        docs = {doc["_id"]: doc for doc in res["docs"]}
+        outdated = []
+        for pk, updated_at in batch:
+            doc = docs.get(str(pk), {})
+            if not doc.get("found"):
+                counts["missing"] += 1
+            elif parse_datetime(str(doc["_source"].get("updated_at", ""))) != updated_at:
+                counts["stale"] += 1
+            else:
+                continue
+            outdated.append(pk)
+        if outdated and not dry_run:
+            enqueue(outdated)
+
+    hits = helpers.scan(client, index=INDEX, size=batch_size,
+                        query={"_source": ["title", "content", "content_json", "created_at"]
+                               if orphans == "adopt" else False})
+    for batch in chunked(hits, batch_size):
+        ids = {hit["_id"]: parse_uuid(hit["_id"]) for hit in batch}
+        existing = {str(pk) for pk in Article.objects.filter(
+            pk__in=[pk for pk in ids.values() if pk is not None]).values_list("pk", flat=True)}
+        # 還在 outbox 裡的是剛刪掉、還沒同步的文章
+        pending = {str(pk) for pk in ArticleOutbox.objects.filter(
+            article_id__in=[pk for pk in ids.values() if pk is not None]).values_list(
+                "article_id", flat=True)}
+        orphan_hits = [hit for hit in batch
+                       if hit["_id"] not in existing and hit["_id"] not in pending]
+        counts["orphan"] += len(orphan_hits)
+        if not orphan_hits or dry_run or orphans == "report":
+            continue
+        if orphans == "adopt":
+            adopt([hit for hit in orphan_hits if ids[hit["_id"]] is not None])
+        else:
+            helpers.bulk(client, ({"_op_type": "delete", "_index": INDEX, "_id": hit["_id"]}
+                                  for hit in orphan_hits), raise_on_error=False)
+    return counts
@@ -3,6 +3,13 @@ from .models import Article, ArticleAttachment
 
 
 class ArticleSerializer(serializers.Serializer):
-    title = serializers.CharField()
+    title = serializers.CharField(max_length=255)
     content = serializers.CharField(required=False)
     content_json = serializers.JSONField()
+
+
+class ArticleAttachmentSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ArticleAttachment
+        fields = ['id', 'file', 'uploaded_at']
+        read_only_fields = ['file']
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from pyshop.storage import delete_file_on_commit
+from .models import Article, ArticleAttachment, ArticleOutbox
+
+# 注意：queryset.update() / bulk_create() 不會觸發 signal，需要自行寫 outbox
+# （見 library.outbox.enqueue），或事後用 reconcile_articles 補
+
+
+@receiver(post_delete, sender=ArticleAttachment)
+def delete_attachment_file(sender, instance, **kwargs):
+    # 只移除檔名，blob 沒有其他人用時由 gc_media_blobs 回收
+    delete_file_on_commit(ArticleAttachment, 'file', instance.file.name)
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def enqueue_article(sender, instance, **kwargs):
+    # Article.save() 與 delete() 都包在 transaction 裡，outbox 跟資料列一起 commit 或 rollback；
+    # 請求不等 ES，由 process_article_outbox 送出
+    ArticleOutbox.objects.create(article_id=instance.pk)
@@ -1,3 +1,316 @@
-from django.test import TestCase
+import io
+import json
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .es import build_search_body, get_client
+from .ingest import ArticleIngester, read_articles
+from .models import Article, ArticleOutbox
+from .outbox import drain, reconcile
+from .tiptap import extract_sections, extract_text_from_tiptap
+from .views import decode_cursor, encode_cursor
+
+
+class GetClientTests(SimpleTestCase):
+    def test_client_shared_between_calls(self):
+        self.assertIs(get_client(), get_client())
+
+    def test_client_uses_pool_settings(self):
+        node = get_client().transport.node_pool.all()[0]
+
+        self.assertEqual(node.config.connections_per_node, 10)
+        self.assertTrue(get_client()._retry_on_timeout)
+
+    @override_settings(LIBRARY_ES_TIMEOUTS={'search': 0.5})
+    def test_operation_timeout(self):
+        self.assertEqual(get_client('search')._request_timeout, 0.5)
+        self.assertEqual(get_client('get')._request_timeout, 2)
+
+
+class SearchBodyTests(SimpleTestCase):
+    def test_listing_fetches_only_title_and_date(self):
+        body = build_search_body('', size=5)
+
+        self.assertEqual(body['query'], {'match_all': {}})
+        self.assertEqual(body['size'], 5)
+        self.assertEqual(body['_source'], {'includes': ['title', 'created_at']})
+        self.assertIn('content', body['highlight']['fields'])
+        self.assertNotIn('search_after', body)
+
+    def test_search_after(self):
+        body = build_search_body('django', search_after=[1700000000000, 'abc'])
+
+        self.assertEqual(body['search_after'], [1700000000000, 'abc'])
+        self.assertEqual(body['query']['multi_match']['query'], 'django')
+
+
+class ArticleESViewTests(TestCase):
+    @mock.patch('library.views.search_article')
+    def test_next_cursor_round_trips(self, search_article):
+        search_article.return_value = ([{'id': 'a'}], [1700000000000, 'a'])
+        client = APIClient()
+
+        response = client.get('/library/esearch/', {'q': 'x', 'size': 1})
+        client.get(response.data['next'])
+
+        self.assertEqual(response.data['results'], [{'id': 'a'}])
+        search_article.assert_called_with('x', 1, [1700000000000, 'a'])
+
+    @mock.patch('library.views.search_article')
+    def test_last_page_has_no_next(self, search_article):
+        search_article.return_value = ([], None)
+
+        response = APIClient().get('/library/esearch/')
+
+        self.assertIsNone(response.data['next'])
+        search_article.assert_called_with('', 20, None)
+
+    def test_invalid_cursor_return_400(self):
+        response = APIClient().get('/library/esearch/', {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_wrong_shape_return_400(self):
+        for search_after in ([1], ['a', 'b'], [True, 'b'], [1, 2], {'a': 1}, [1, 'b', 'c']):
+            response = APIClient().get('/library/esearch/',
+                                       {'cursor': encode_cursor(search_after)})
+
+            self.assertEqual(response.status_code, 400, search_after)
+
+    @mock.patch('library.es.get_client')
+    def test_detail_logs_es_errors(self, get_client):
+        get_client.return_value.get.side_effect = ConnectionError('down')
+
+        with self.assertLogs('library.es', level='ERROR'):
+            response = APIClient().get(f'/library/esearch/{uuid.uuid4()}/')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_post_saves_article_without_es(self):
+        content_json = {'type': 'doc', 'content': [paragraph('hello')]}
+
+        response = APIClient().post('/library/esearch/', {'title': 't', 'content_json': content_json},
+                                    format='json')
+
+        article = Article.objects.get(pk=response.data['id'])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(article.content, 'hello')
+        self.assertEqual(ArticleOutbox.objects.get().article_id, article.pk)
+
+    def test_cursor_helpers(self):
+        self.assertEqual(decode_cursor(encode_cursor([1, 'b'])), [1, 'b'])
+        self.assertIsNone(decode_cursor(''))
+
+
+def fake_streaming_bulk(client, actions, chunk_size, **kwargs):
+    for action in actions:
+        client.indexed.append(action)
+        yield True, {'index': {'_id': action['_id']}}
+
+
+class ArticleIngesterTests(TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.indexed = []
+        self.client.indices.get_settings.return_value = {
+            'articles': {'settings': {'index': {'refresh_interval': '1s'}}}}
+        patcher = mock.patch('library.ingest.helpers.streaming_bulk', fake_streaming_bulk)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rows(self):
+        lines = [
+            json.dumps({'title': 'a', 'content_json': {'content': [{'text': 'hello'}]}}),
+            'not json',
+            json.dumps({'title': 'b'}),
+            json.dumps({'title': 'c', 'content_json': {'text': 'world'}}),
+            '[' * 100000 + ']' * 100000,
+        ]
+        return read_articles(io.StringIO('\n'.join(lines)))
+
+    def test_indexes_valid_rows_and_reports_errors(self):
+        result = ArticleIngester(chunk_size=1, workers=0, client=self.client).run(self.rows())
+
+        self.assertEqual(result['indexed'], 2)
+        self.assertEqual([e['line'] for e in result['errors']], [2, 3, 5])
+        self.assertEqual([a['_source']['content'] for a in self.client.indexed],
+                         ['hello', 'world'])
+
+    def test_rows_saved_with_index_timestamps(self):
+        ArticleIngester(workers=0, client=self.client).run(self.rows())
+
+        article = Article.objects.get(title='a')
+        source = self.client.indexed[0]['_source']
+        self.assertEqual(source['id'], str(article.pk))
+        self.assertEqual(source['updated_at'], article.updated_at)
+        self.assertFalse(ArticleOutbox.objects.exists())
+
+    def test_overwrite_keeps_created_at(self):
+        article = Article.objects.create(title='old', content='x')
+        created_at = article.created_at
+        row = {'id': str(article.pk), 'title': 'new', 'content_json': {'text': 'hello'}}
+
+        ArticleIngester(workers=0, client=self.client).run([(1, row)])
+
+        article.refresh_from_db()
+        self.assertEqual(article.title, 'new')
+        self.assertEqual(article.created_at, created_at)
+        self.assertEqual(self.client.indexed[0]['_source']['created_at'], created_at)
+
+    def test_bulk_view_queues_rows_for_outbox(self):
+        client = APIClient()
+        client.force_authenticate(user=get_user_model().objects.create_user(
+            'admin@example.com', is_staff=True))
+        upload = io.BytesIO(b''.join(line.encode() + b'\n' for line in [
+            json.dumps({'title': 'a', 'content_json': {'text': 'hello'}}), 'not json']))
+        upload.name = 'articles.ndjson'
+
+        response = client.post('/library/esearch/bulk/', {'file': upload})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['queued'], 1)
+        self.assertEqual(response.data['errors'], [{'line': 2, 'error': '格式錯誤'}])
+        article = Article.objects.get(title='a')
+        self.assertEqual(article.content, 'hello')
+        self.assertEqual(list(ArticleOutbox.objects.values_list('article_id', flat=True)),
+                         [article.pk])
+        self.assertEqual(self.client.indexed, [])
+
+    def test_process_pool(self):
+        result = ArticleIngester(chunk_size=2, workers=2, client=self.client).run(self.rows())
+
+        self.assertEqual(result['indexed'], 2)
+
+    def test_refresh_disabled_during_load(self):
+        ArticleIngester(workers=0, client=self.client).run(self.rows())
+
+        calls = self.client.indices.put_settings.call_args_list
+        self.assertEqual(calls[0].kwargs['settings'], {'index': {'refresh_interval': '-1'}})
+        self.assertEqual(calls[1].kwargs['settings'], {'index': {'refresh_interval': '1s'}})
+        self.client.indices.refresh.assert_called_once()
+
+
+def paragraph(*texts):
+    return {'type': 'paragraph', 'content': [{'type': 'text', 'text': t} for t in texts]}
+
+
+class TiptapTests(SimpleTestCase):
+    def test_extract_text(self):
+        doc = {'type': 'doc', 'content': [paragraph('Hel', 'lo'), paragraph('world')]}
+
+        self.assertEqual(extract_text_from_tiptap(doc), 'Hello world')
+
+    def test_deep_nesting(self):
+        node = paragraph('leaf')
+        for _ in range(10000):
+            node = {'type': 'bulletList', 'content': [{'type': 'listItem', 'content': [node]}]}
+
+        self.assertEqual(extract_text_from_tiptap({'type': 'doc', 'content': [node]}), 'leaf')
+
+    def test_skip_images_and_break_lines(self):
+        doc = {'type': 'doc', 'content': [
+            {'type': 'image', 'attrs': {'src': 'a.png'}, 'content': [{'text': 'x'}]},
+            {'type': 'paragraph', 'content': [
+                {'type': 'text', 'text': 'a'}, {'type': 'hardBreak'}, {'type': 'text', 'text': 'b'}]},
+        ]}
+
+        self.assertEqual(extract_text_from_tiptap(doc), 'a b')
+
+    def test_extract_sections(self):
+        doc = {'type': 'doc', 'content': [
+            paragraph('intro'),
+            {'type': 'heading', 'attrs': {'level': 2}, 'content': [{'type': 'text', 'text': 'Part'}]},
+            paragraph('body'),
+        ]}
+
+        self.assertEqual(extract_sections(doc), [
+            {'heading': '', 'level': None, 'text': 'intro'},
+            {'heading': 'Part', 'level': 2, 'text': 'body'},
+        ])
+
+
+def outbox_streaming_bulk(client, actions, chunk_size, **kwargs):
+    for action in actions:
+        op_type = action.get('_op_type', 'index')
+        client.sent.append((op_type, action['_id']))
+        if action['_id'] in client.failing:
+            yield False, {op_type: {'_id': action['_id'], 'status': 503, 'error': 'unavailable'}}
+        elif op_type == 'delete':
+            yield False, {op_type: {'_id': action['_id'], 'status': 404}}
+        else:
+            yield True, {op_type: {'_id': action['_id'], 'status': 201}}
+
+
+class ArticleOutboxTests(TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.sent = []
+        self.client.failing = set()
+        patcher = mock.patch('library.outbox.helpers.streaming_bulk', outbox_streaming_bulk)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_save_and_delete_write_outbox(self):
+        article = Article.objects.create(title='a', content='x')
+        article.title = 'b'
+        article.save()
+        pk = article.pk
+        article.delete()
+
+        self.assertEqual(list(ArticleOutbox.objects.values_list('article_id', flat=True)),
+                         [pk, pk, pk])
+
+    def test_rollback_discards_outbox(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Article.objects.create(title='a', content='x')
+            raise RuntimeError
+
+        self.assertFalse(ArticleOutbox.objects.exists())
+
+    def test_drain_indexes_current_state_once(self):
+        kept = Article.objects.create(title='a', content='x')
+        kept.save()
+        deleted = Article.objects.create(title='b', content='y')
+        deleted_pk = deleted.pk
+        deleted.delete()
+
+        self.assertEqual(drain(client=self.client), 4)
+
+        self.assertEqual(self.client.sent, [('index', str(kept.pk)), ('delete', str(deleted_pk))])
+        self.assertFalse(ArticleOutbox.objects.exists())
+
+    def test_failed_entries_retried_later(self):
+        article = Article.objects.create(title='a', content='x')
+        self.client.failing = {str(article.pk)}
+
+        drain(client=self.client)
+
+        entry = ArticleOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, 'unavailable')
+        self.assertEqual(drain(client=self.client), 0)
+
+    @mock.patch('library.outbox.helpers.scan')
+    def test_reconcile(self, scan):
+        fresh = Article.objects.create(title='a', content='x')
+        stale = Article.objects.create(title='b', content='y')
+        missing = Article.objects.create(title='c', content='z')
+        ArticleOutbox.objects.all().delete()
+        self.client.mget.return_value = {'docs': [
+            {'_id': str(fresh.pk), 'found': True,
+             '_source': {'updated_at': fresh.updated_at.isoformat()}},
+            {'_id': str(stale.pk), 'found': True, '_source': {}},
+            {'_id': str(missing.pk), 'found': False},
+        ]}
+        scan.return_value = [{'_id': str(fresh.pk)}, {'_id': 'legacy'}]
+
+        counts = reconcile(client=self.client)
+
+        self.assertEqual(counts, {'missing': 1, 'stale': 1, 'orphan': 1})
+        self.assertEqual(set(ArticleOutbox.objects.values_list('article_id', flat=True)),
+                         {stale.pk, missing.pk})
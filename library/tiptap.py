@@ -0,0 +1,71 @@
+"""
+Tiptap JSON 轉純文字：用 stack 迭代走訪，不受遞迴深度限制，
+文字片段只在最後 join 一次，不會在每一層產生中間字串
+"""
+
+# 沒有文字內容的節點，不往下走
+SKIP_TYPES = frozenset({'image', 'horizontalRule', 'iframe', 'youtube', 'video'})
+# 本身沒有內容，但代表斷行的節點
+BREAK_TYPES = frozenset({'hardBreak'})
+# 區塊結束的標記，放進 stack 裡
+_BLOCK_END = object()
+
+
+def extract_text_from_tiptap(content_json):
+    """同一段裡被 marks 切開的文字直接接起來，段落之間用一個空白分隔"""
+    parts = []
+    append = parts.append
+    separate = False
+    stack = [content_json]
+    pop = stack.pop
+    while stack:
+        node = pop()
+        if node is _BLOCK_END:
+            separate = bool(parts)
+        elif isinstance(node, dict):
+            text = node.get('text')
+            if isinstance(text, str):
+                if text:
+                    if separate:
+                        append(' ')
+                        separate = False
+                    append(text)
+                continue
+            node_type = node.get('type')
+            if node_type in SKIP_TYPES:
+                continue
+            if node_type in BREAK_TYPES:
+                separate = bool(parts)
+                continue
+            children = node.get('content')
+            if isinstance(children, list):
+                stack.append(_BLOCK_END)
+                stack.extend(reversed(children))
+        elif isinstance(node, list):
+            stack.extend(reversed(node))
+    return ''.join(parts)
+
+
+def extract_sections(content_json):
+    """
+    依最上層的 heading 切段，回傳 [{'heading', 'level', 'text'}]；
+    第一個 heading 之前的內容 heading 為空字串
+    """
+    nodes = content_json.get('content', []) if isinstance(content_json, dict) else content_json
+    sections = [{'heading': '', 'level': None, 'nodes': []}]
+    for node in nodes or []:
+        if isinstance(node, dict) and node.get('type') == 'heading':
+            sections.append({
+                'heading': extract_text_from_tiptap(node),
+                'level': (node.get('attrs') or {}).get('level'),
+                'nodes': [],
+            })
+        else:
+            sections[-1]['nodes'].append(node)
+
+    result = []
+    for section in sections:
+        text = extract_text_from_tiptap(section.pop('nodes'))
+        if section['heading'] or text:
+            result.append({**section, 'text': text})
+    return result
@@ -3,8 +3,11 @@ from django.urls import path
 from . import views
 
 router = routers.DefaultRouter()
+router.register(r'articles/(?P<article_pk>[0-9a-f-]{36})/attachments',
+                views.ArticleAttachmentViewSet, basename='article-attachments')
 
 urlpatterns = router.urls + [
     path('esearch/', views.ArticleESView.as_view()),
+    path('esearch/bulk/', views.ArticleBulkView.as_view()),
     path('esearch/<str:id>/', views.ArticleDetailView.as_view()),
 ]
@@ -1,32 +1,103 @@
 from rest_framework.generics import GenericAPIView
 from rest_framework.views import APIView
+from rest_framework.viewsets import mixins, GenericViewSet
 from rest_framework.response import Response
+from django.shortcuts import get_object_or_404
 from pyshop.permission import IsAdminOrReadOnly
-from datetime import datetime
-from rest_framework import status
+from pyshop.uploads import ChunkedUploadMixin
+from rest_framework import permissions, status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.utils.urls import replace_query_param
+import base64
+import binascii
+import json
 
-from .serializers import ArticleSerializer
-from .es import search_article, add_article, get_article_by_id
+from .models import Article, ArticleAttachment
+from .serializers import ArticleSerializer, ArticleAttachmentSerializer
+from .es import search_article, get_article_by_id
+from .ingest import ArticleIngester, read_articles
+from .tiptap import extract_text_from_tiptap
 
 
 
+def encode_cursor(search_after):
+    return base64.urlsafe_b64encode(json.dumps(search_after).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """cursor 格式錯誤時丟 ValueError；內容必須是 search_after 的 [created_at, id]"""
+    if not cursor:
+        return None
+    try:
+        search_after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, RecursionError):
+        raise ValueError(cursor)
+    # created_at 是 epoch 毫秒（bool 也是 int，要排除），id 是字串
+    if (not isinstance(search_after, list) or len(search_after) != 2
+            or not isinstance(search_after[0], int) or isinstance(search_after[0], bool)
+            or not isinstance(search_after[1], str)):
+        raise ValueError(cursor)
+    return search_after
+
+
 class ArticleESView(GenericAPIView):
     serializer_class = ArticleSerializer
     queryset = []
 
+    page_size = 20
+    max_page_size = 100
+
     def get(self, request):
+        """?q= 搜尋、?size= 每頁筆數、?cursor= 上一頁回傳的 next"""
         query = request.GET.get("q", "")
-        data = search_article(query)
-        return Response(data)
+        try:
+            size = min(max(int(request.GET.get("size", self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            size = self.page_size
+        try:
+            search_after = decode_cursor(request.GET.get("cursor"))
+        except ValueError:
+            return Response({'error': '無效的 cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results, next_after = search_article(query, size, search_after)
+        next_url = None
+        if next_after is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", encode_cursor(next_after))
+        return Response({"next": next_url, "results": results})
 
     def post(self, request):
-        print(datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3])
         serializer = ArticleSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
-        res = add_article(data["title"], data["content_json"])
-        return Response(res)
-    
+        # 只寫資料列，索引由 outbox 在背景更新（見 library.outbox），請求不等 ES
+        article = Article.objects.create(
+            title=data["title"], content_json=data["content_json"],
+            content=data.get("content") or extract_text_from_tiptap(data["content_json"]))
+        return Response({"id": str(article.pk), "title": article.title},
+                        status=status.HTTP_201_CREATED)
+
+
+
+class ArticleBulkView(APIView):
+    """
+    上傳 NDJSON 檔（每行 {title, content_json}）：請求裡只存資料列並寫進 outbox，
+    索引由 process_article_outbox 在背景更新。大量匯入請用 ingest_articles 指令
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': '請上傳 file'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            chunk_size = min(max(int(request.data.get('chunk_size', 500)), 1), 5000)
+        except ValueError:
+            return Response({'error': 'chunk_size 必須是整數'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ingester = ArticleIngester(chunk_size=chunk_size)
+        return Response(ingester.queue(read_articles(upload)), status=status.HTTP_202_ACCEPTED)
 
 
 class ArticleDetailView(APIView):
@@ -35,3 +106,21 @@ class ArticleDetailView(APIView):
         if not article:
             return Response({'error': '找不到文章'}, status=status.HTTP_404_NOT_FOUND)
         return Response(article)
+
+
+class ArticleAttachmentViewSet(ChunkedUploadMixin, mixins.ListModelMixin,
+                               mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                               GenericViewSet):
+    """附件只能用分段上傳新增（見 pyshop.uploads）"""
+    serializer_class = ArticleAttachmentSerializer
+    permission_classes = [IsAdminOrReadOnly]
+    upload_to = 'attachments/'
+
+    def get_queryset(self):
+        return ArticleAttachment.objects.filter(article_id=self.kwargs['article_pk'])
+
+    def get_upload_parent(self):
+        return get_object_or_404(Article, pk=self.kwargs['article_pk'])
+
+    def create_from_upload(self, name, upload, parent):
+        return ArticleAttachment.objects.create(article=parent, file=name)
@@ -0,0 +1,112 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.urls import re_path
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .storage import BLOB_DIR, is_hashed_name
+
+# 檔名帶內容雜湊的檔案永遠不會變，瀏覽器 / CDN 可以快取一年且不用再驗證
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+READ_BLOCK = 64 * 1024
+
+
+def iter_range(file, length):
+    with file:
+        while length > 0:
+            block = file.read(min(READ_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def file_response(request, path, size, content_type):
+    """只在 MEDIA_SERVING = 'django' 時用，支援單一區段的 Range"""
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if match is None or match.groups() == ('', ''):
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    start, end = match.groups()
+    if start == '':
+        # bytes=-500：最後 500 bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(path, 'rb')
+    file.seek(start)
+    response = StreamingHttpResponse(
+        iter_range(file, end - start + 1), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+
+def serve_media(request, path):
+    """
+    MEDIA_URL 的 view，依 settings.MEDIA_SERVING：
+    'accel'    回 X-Accel-Redirect，由 nginx 的 internal location 送出檔案（含 Range）
+    'sendfile' 回 X-Sendfile（Apache mod_xsendfile / lighttpd）
+    'django'   開發用，只在 DEBUG 時由 Django 送出，跟 static() 一樣
+
+    生產環境建議讓 nginx 直接處理 MEDIA_URL（見 README），完全不經過 Django
+    """
+    mode = getattr(settings, 'MEDIA_SERVING', 'django')
+    if mode == 'django' and not settings.DEBUG:
+        raise Http404
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (ValueError, OSError):
+        raise Http404
+    # 正規化之後再檢查，./.blobs/ 或 x/../.blobs/ 也不能拿到 blob
+    path = os.path.relpath(full_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    if path.split('/')[0] == BLOB_DIR or not os.path.isfile(full_path):
+        raise Http404
+
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+    else:
+        content_type, encoding = mimetypes.guess_type(full_path)
+        content_type = content_type or 'application/octet-stream'
+        if mode == 'accel':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+        elif mode == 'sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = full_path
+        else:
+            response = file_response(request, full_path, stat.st_size, content_type)
+        response['Accept-Ranges'] = 'bytes'
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = (
+        IMMUTABLE_CACHE_CONTROL if is_hashed_name(path) else DEFAULT_CACHE_CONTROL)
+    return response
+
+
+def media_urlpatterns():
+    """
+    MEDIA_SERVING = 'nginx' 時 MEDIA_URL 完全交給 nginx，Django 不處理；
+    'django' 在 DEBUG 關閉時由 serve_media 回 404，不會在生產環境用 Python 送檔
+    """
+    if getattr(settings, 'MEDIA_SERVING', 'django') == 'nginx':
+        return []
+    prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
+    return [re_path(rf'^{prefix}(?P<path>.+)$', serve_media, name='media')]
@@ -109,12 +109,35 @@ CACHES = {
     }
 }
 
+# 購物車存放位置：'sql'（Cart / CartItem 資料表）或 'redis'（store.carts.RedisCartStore）
+CART_BACKEND = os.environ.get('CART_BACKEND', 'sql')
+# Redis 購物車閒置多久後過期（秒）
+CART_TTL = 60 * 60 * 24 * 7
+
+# django_elasticsearch_dsl 與 library.es 共用同一個 client / 連線池（見 library.es.get_client）
 ELASTICSEARCH_DSL = {
     'default': {
-        'hosts': 'http://localhost:9200'  
+        'hosts': os.environ.get('ELASTICSEARCH_HOSTS', 'http://localhost:9200').split(','),
+        # 預設逾時（秒），個別呼叫再用 .options(request_timeout=) 調整
+        'request_timeout': 5,
+        'max_retries': 2,
+        'retry_on_timeout': True,
+        # 每個 node 的 HTTP 連線池大小，約等於每個 process 同時打 ES 的請求數
+        'connections_per_node': 10,
+        'http_compress': True,
+        # 直連 cluster 時可開啟 sniffing 自動找其他 node；經過 load balancer 時保持關閉
+        'sniff_on_start': os.environ.get('ELASTICSEARCH_SNIFF') == '1',
+        'sniff_on_node_failure': os.environ.get('ELASTICSEARCH_SNIFF') == '1',
+        'min_delay_between_sniffing': 60,
     }
 }
 
+# 產品搜尋：'elasticsearch'（store.documents.ProductDocument）或 'memory'（沒有 ES node 時）
+PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND', 'elasticsearch')
+
+# 產品圖片縮圖 / WebP 的背景 thread 數，0 表示在 commit 後同步產生（見 store.images）
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get('IMAGE_DERIVATIVE_WORKERS', 2))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -160,7 +183,19 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/')
+# MEDIA_URL 由誰送出檔案（見 pyshop.media）：
+# 'django' 開發用、'accel' nginx X-Accel-Redirect、'sendfile' X-Sendfile、'nginx' 完全不經過 Django
+MEDIA_SERVING = os.environ.get('MEDIA_SERVING', 'django')
+# 'accel' 時 nginx 對應到 MEDIA_ROOT 的 internal location
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# 上傳檔依 SHA-256 去重複，見 pyshop.storage
+STORAGES = {
+    'default': {'BACKEND': 'pyshop.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 MARKDOWNX_MEDIA_PATH = 'library/'
+# 分段上傳的暫存檔（見 pyshop.uploads），不能放在 MEDIA_ROOT 底下，否則未驗證的內容會被公開送出
+CHUNKED_UPLOAD_DIR = os.environ.get('CHUNKED_UPLOAD_DIR', os.path.join(BASE_DIR, 'uploads-partial'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import transaction
+
+BLOB_DIR = '.blobs'
+HASH_LENGTH = 16
+# hashed_name 產生的檔名（get_available_name 可能再加上 _xxxxxxx）
+HASHED_NAME_RE = re.compile(r'[./][0-9a-f]{16,64}(?:_[A-Za-z0-9]{7})?\.[^./]+$')
+
+
+def is_hashed_name(name):
+    """內容不會再變的檔名，可以用 immutable 快取"""
+    return bool(HASHED_NAME_RE.search('/' + name))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    內容定址的 FileSystemStorage：
+    實際內容只存一份在 .blobs/ab/cd/<sha256>，每個檔名都是指向 blob 的 hard link，
+    所以同一張圖上傳幾次都只佔一份空間。檔名本身也帶內容雜湊（見 hashed_name）。
+
+    blob 的 link 數（st_nlink）就是參考計數：刪掉檔名只會少一個 link，
+    剩下 1（只有 .blobs 裡那個）的 blob 由 gc_media_blobs 指令分批回收
+    """
+
+    def blob_path(self, digest):
+        return os.path.join(self.location, BLOB_DIR, digest[:2], digest[2:4], digest)
+
+    def _write_temp(self, content):
+        directory = os.path.join(self.location, BLOB_DIR, 'tmp')
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=directory, delete=False) as tmp:
+            for chunk in content.chunks():
+                tmp.write(chunk)
+                digest.update(chunk)
+        return tmp.name, digest.hexdigest()
+
+    def _link(self, blob, name):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        while True:
+            try:
+                os.link(blob, self.path(name))
+                return name
+            except FileExistsError:
+                name = self.get_available_name(name)
+
+    def hashed_name(self, name, digest, max_length=100):
+        """photo.png -> photo.<sha256 前 16 碼>.png，檔名變成內容的函數，URL 可以永久快取"""
+        if digest[:HASH_LENGTH] in os.path.basename(name):
+            return name
+        root, ext = os.path.splitext(name)
+        suffix = f'.{digest[:HASH_LENGTH]}{ext}'
+        return root[:max_length - len(suffix)] + suffix
+
+    def _save(self, name, content):
+        tmp_path, digest = self._write_temp(content)
+        name = self.hashed_name(name, digest)
+        blob = self.blob_path(digest)
+        try:
+            # 已經有相同內容就只加一個 link
+            name = self._link(blob, name)
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            # 沒有這個 blob（或剛好被 GC 掉），把暫存檔搬過去當 blob
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp_path, blob)
+            if self.file_permissions_mode is not None:
+                os.chmod(blob, self.file_permissions_mode)
+            name = self._link(blob, name)
+        return str(name).replace('\\', '/')
+
+    def unreferenced_blobs(self, grace=60 * 60):
+        """
+        只剩 .blobs 裡一個 link 的 blob；剛寫入不到 grace 秒的先跳過，
+        避免跟正在上傳、還沒建立 link 的請求搶
+        """
+        root = os.path.join(self.location, BLOB_DIR)
+        cutoff = time.time() - grace
+        for directory, dirnames, filenames in os.walk(root):
+            if directory == root:
+                dirnames[:] = [d for d in dirnames if d != 'tmp']
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_nlink == 1 and stat.st_mtime < cutoff:
+                    yield path, stat.st_size
+
+
+def delete_file_on_commit(model, field_name, name):
+    """
+    資料列刪除後移除它的檔名（也就是 blob 的一個 link）；
+    還有其他資料列用同一個檔名時保留
+    """
+    if not name:
+        return
+
+    def delete():
+        if not model.objects.filter(**{field_name: name}).exists():
+            default_storage.delete(name)
+
+    transaction.on_commit(delete)
@@ -0,0 +1,249 @@
+import fcntl
+import hashlib
+import os
+import re
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.http import Http404
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import BaseParser
+from rest_framework.response import Response
+
+# 未完成的上傳保留多久（秒），過期就要重來
+UPLOAD_TTL = 60 * 60 * 24
+READ_BLOCK = 1024 * 1024
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class RawChunkParser(BaseParser):
+    """讓 DRF 接受分段上傳的 Content-Type，實際內容由 view 直接讀 request.stream"""
+    media_type = 'application/offset+octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return {}
+
+
+def file_sha256(file):
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(READ_BLOCK), b''):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+class ChunkedUpload:
+    """
+    一次可續傳的上傳：
+    中繼資料存在 cache（生產環境是 Redis），內容逐段 append 到 CHUNKED_UPLOAD_DIR 的暫存檔，
+    目前的 offset 就是暫存檔的大小，所以斷線後用 GET 問 offset 就能從那裡續傳
+    """
+
+    def __init__(self, upload_id, meta):
+        self.id = upload_id
+        self.meta = meta
+
+    @staticmethod
+    def key(upload_id):
+        return f'pyshop:upload:{upload_id}'
+
+    @staticmethod
+    def directory():
+        # 不放在 MEDIA_ROOT 底下，還沒檢查過的內容不會被公開送出
+        return getattr(settings, 'CHUNKED_UPLOAD_DIR',
+                       os.path.join(settings.BASE_DIR, 'uploads-partial'))
+
+    @classmethod
+    def expired_parts(cls, max_age=UPLOAD_TTL):
+        """中繼資料已經過期、超過 max_age 秒沒有寫入的暫存檔，回傳 (路徑, 大小)"""
+        cutoff = time.time() - max_age
+        try:
+            entries = os.scandir(cls.directory())
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                upload_id, extension = os.path.splitext(entry.name)
+                if extension != '.part' or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if stat.st_mtime < cutoff and cache.get(cls.key(upload_id)) is None:
+                    yield entry.path, stat.st_size
+
+    @property
+    def path(self):
+        return os.path.join(self.directory(), f'{self.id}.part')
+
+    @classmethod
+    def start(cls, **meta):
+        upload = cls(uuid4().hex, meta)
+        os.makedirs(cls.directory(), exist_ok=True)
+        open(upload.path, 'wb').close()
+        cache.set(cls.key(upload.id), meta, UPLOAD_TTL)
+        return upload
+
+    @classmethod
+    def get(cls, upload_id):
+        meta = cache.get(cls.key(upload_id))
+        if meta is None:
+            return None
+        return cls(upload_id, meta)
+
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def append(self, stream, offset, length):
+        """
+        offset 必須等於目前已收到的大小，否則回傳 False（重送或亂序的 chunk）；
+        用 flock 避免同一個上傳的兩個 chunk 同時寫入
+        """
+        with open(self.path, 'ab') as part:
+            fcntl.flock(part, fcntl.LOCK_EX)
+            # 'ab' 的 tell() 是開檔時的位置，等鎖期間別人寫入的部分要重新取得
+            if part.seek(0, os.SEEK_END) != offset or offset + length > self.meta['size']:
+                return False
+            remaining = length
+            while remaining:
+                block = stream.read(min(READ_BLOCK, remaining))
+                if not block:
+                    break
+                part.write(block)
+                remaining -= len(block)
+        cache.touch(self.key(self.id), UPLOAD_TTL)
+        return True
+
+    def checksum(self):
+        with open(self.path, 'rb') as part:
+            return file_sha256(part)
+
+    def store(self, upload_to):
+        """
+        依內容的 SHA-256 命名存進 default_storage；
+        每個資料列各有自己的檔名，重複內容由 ContentAddressedStorage 共用同一個 blob
+        """
+        extension = os.path.splitext(self.meta['filename'])[1].lower()
+        with open(self.path, 'rb') as part:
+            return default_storage.save(
+                f'{upload_to}{self.meta["sha256"]}{extension}', File(part))
+
+    def discard(self):
+        cache.delete(self.key(self.id))
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ChunkedUploadMixin:
+    """
+    給 ViewSet 用的分段上傳 API，取代一次把整個檔案 POST 進 Django 的預設上傳：
+
+    POST   uploads/                    {filename, size, sha256} 開始上傳
+    GET    uploads/{id}/               查詢目前 offset（續傳用）
+    PATCH  uploads/{id}/               Upload-Offset header + 原始內容，append 一段
+    POST   uploads/{id}/finalize/      檢查大小與 checksum，存檔並建立資料列
+
+    子類別設定 upload_to，並實作 get_upload_parent() 取得上層物件（找不到丟 Http404）、
+    create_from_upload(name, upload, parent) 建立資料列；
+    需要檢查內容（例如是不是圖片）時覆寫 validate_upload，丟 ValidationError 會回 400
+    """
+    upload_to = ''
+    max_upload_size = 100 * 1024 * 1024
+    max_chunk_size = 8 * 1024 * 1024
+
+    def validate_upload(self, upload):
+        pass
+
+    def get_upload_parent(self):
+        return None
+
+    def create_from_upload(self, name, upload, parent):
+        raise NotImplementedError
+
+    def upload_scope(self):
+        # 上傳只能在開始時的同一個上層物件（例如同一個產品）完成
+        return {key: str(value) for key, value in self.kwargs.items()
+                if key != 'upload_id'}
+
+    def get_upload(self, upload_id):
+        upload = ChunkedUpload.get(upload_id)
+        if upload is None or upload.meta['scope'] != self.upload_scope():
+            raise NotFound('找不到上傳')
+        return upload
+
+    def upload_status(self, upload):
+        return {'id': upload.id, 'offset': upload.offset, 'size': upload.meta['size']}
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def start_upload(self, request, **kwargs):
+        filename = str(request.data.get('filename') or '')
+        sha256 = str(request.data.get('sha256') or '').lower()
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            size = -1
+        if not filename or not SHA256_RE.match(sha256):
+            return Response({'error': '需要 filename 與 sha256'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < size <= self.max_upload_size:
+            return Response({'error': f'size 必須介於 1 到 {self.max_upload_size}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        upload = ChunkedUpload.start(
+            filename=filename, size=size, sha256=sha256, scope=self.upload_scope())
+        return Response(self.upload_status(upload), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get', 'patch'], url_path=r'uploads/(?P<upload_id>[0-9a-f]{32})',
+            parser_classes=[RawChunkParser])
+    def upload_chunk(self, request, upload_id, **kwargs):
+        upload = self.get_upload(upload_id)
+        if request.method == 'GET':
+            return Response(self.upload_status(upload))
+
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response({'error': '需要 Upload-Offset 與 Content-Length'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < length <= self.max_chunk_size:
+            return Response({'error': f'每段最多 {self.max_chunk_size} bytes'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # 直接讀 WSGI stream，不經過 Django 的上傳處理，也不會整段放進記憶體
+        if not upload.append(request.stream, offset, length):
+            return Response({'error': 'offset 不符', **self.upload_status(upload)},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(self.upload_status(upload))
+
+    @action(detail=False, methods=['post'],
+            url_path=r'uploads/(?P<upload_id>[0-9a-f]{32})/finalize')
+    def finalize_upload(self, request, upload_id, **kwargs):
+        upload = self.get_upload(upload_id)
+        if upload.offset != upload.meta['size']:
+            return Response({'error': '檔案還沒傳完', **self.upload_status(upload)},
+                            status=status.HTTP_409_CONFLICT)
+        if upload.checksum() != upload.meta['sha256']:
+            upload.discard()
+            return Response({'error': 'sha256 不符，請重新上傳'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            self.validate_upload(upload)
+            # 上層物件在上傳期間被刪掉時，不要先存檔留下沒有資料列的 blob
+            parent = self.get_upload_parent()
+        except (ValidationError, Http404):
+            upload.discard()
+            raise
+        instance = self.create_from_upload(upload.store(self.upload_to), upload, parent)
+        upload.discard()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -19,6 +19,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import include, path
 import debug_toolbar
+from pyshop.media import media_urlpatterns
 
 admin.site.site_header = '後台網頁'
 admin.site.index_title = '管理員'
@@ -32,5 +33,5 @@ urlpatterns = [
     path('auth/', include('djoser.urls.jwt')),
     path('markdownx/', include('markdownx.urls')),
     path('__debug__', include(debug_toolbar.urls))
-]+static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)\
+]+media_urlpatterns()\
  + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -68,6 +68,12 @@ class OrderForm(forms.ModelForm):
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
     form = OrderForm
-    list_display = ['id', 'placed_at', 'customer', 'shipping_address']
+    list_display = ['id', 'placed_at', 'customer', 'shipping_address', 'total']
+    readonly_fields = ['subtotal', 'total']
     inlines = [OrderItemInline]
     list_per_page = 20
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # inline 改了品項後重新計算存起來的金額
+        form.instance.recompute_totals()
@@ -0,0 +1,115 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+# 版本號不設過期；回應本身靠版本號失效，TTL 只是讓 Redis 回收沒人用的舊版本
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def version_key(name, pk):
+    return f'store:version:{name}:{pk}'
+
+
+def get_version(name, pk):
+    key = version_key(name, pk)
+    version = cache.get(key)
+    if version is None:
+        # 版本號被清掉時不能從 1 重來，否則可能撞到舊的回應快取
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(name, pks):
+    """多筆版本號用一次 get_many 取回（列表的 ETag 用），缺的再個別補上"""
+    keys = {version_key(name, pk): pk for pk in pks}
+    found = cache.get_many(keys)
+    return {pk: found[key] if found.get(key) is not None else get_version(name, pk)
+            for key, pk in keys.items()}
+
+
+def bump_version(name, pk):
+    if pk is None:
+        return
+    key = version_key(name, pk)
+    cache.add(key, time.time_ns(), timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # add 和 incr 之間剛好被清掉
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_version_on_commit(name, pk):
+    """
+    signal 裡用：交易 commit 後才 bump；
+    如果在 commit 前 bump，這段期間的讀取會把舊資料存到新版本底下，直到快取過期
+    """
+    transaction.on_commit(lambda: bump_version(name, pk))
+
+
+def invalidate_versions(name, pks):
+    """
+    大量失效用：直接刪掉版本號，下次讀取時 get_version 會給新的值，
+    一次 round trip 取代逐筆 bump_version
+    """
+    keys = [version_key(name, pk) for pk in pks if pk is not None]
+    if keys:
+        cache.delete_many(keys)
+
+
+def response_cache_key(name, pk, request):
+    version = get_version(name, pk)
+    # 同一個物件不同 host / query string（例如 ?expand=）回應不同
+    variant = hashlib.md5(
+        f'{request.get_host()}{request.get_full_path()}'.encode()).hexdigest()
+    return f'store:response:{name}:{pk}:{version}:{variant}'
+
+
+class VersionedCacheRetrieveMixin:
+    """
+    retrieve 的 read-through 快取，key 內含物件的版本號，
+    store.signals 在相關資料寫入時把版本號 +1，舊快取自然失效
+    """
+    cache_name = None
+
+    def get_response_cache_key(self, request, pk):
+        return response_cache_key(self.cache_name, pk, request)
+
+    def retrieve(self, request, *args, **kwargs):
+        key = self.get_response_cache_key(request, kwargs[self.lookup_field])
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().retrieve(request, *args, **kwargs)
+        cache.set(key, response.data, RESPONSE_CACHE_TIMEOUT)
+        return response
+
+
+class VersionedCacheFirstPageMixin:
+    """
+    巢狀列表第一頁（沒有 cursor）的短期快取，key 內含上層物件的版本號，
+    例如產品的評論列表：新增評論時 bump_version('reviews', product_id)
+    """
+    cache_name = None
+    # 上層物件 pk 在 URL kwargs 裡的名稱
+    cache_parent_kwarg = None
+    first_page_cache_timeout = 60
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator.cursor_query_param in request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        key = response_cache_key(
+            self.cache_name, kwargs[self.cache_parent_kwarg], request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+
+        response = super().list(request, *args, **kwargs)
+        cache.set(key, response.data, self.first_page_cache_timeout)
+        return response
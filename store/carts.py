@@ -0,0 +1,166 @@
+import hashlib
+import hmac
+import secrets
+from uuid import uuid4
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from .models import CartItem
+
+
+def get_cart_store():
+    """settings.CART_BACKEND = 'redis' 時回傳 RedisCartStore，'sql' 時回傳 None"""
+    if getattr(settings, 'CART_BACKEND', 'sql') == 'redis':
+        return RedisCartStore()
+    return None
+
+
+class RedisCartStore:
+    """
+    購物車存在 Redis，結帳時才寫進 SQL（見 OrderCreateSerializer）
+
+    store:cart:{id}        hash  product_id -> quantity（HINCRBY 原子累加）
+    store:cart:{id}:price  hash  product_id -> 加入當下的價格
+    store:cart:{id}:meta   hash  user -> 擁有者 id（匿名購物車為 token -> token 的 SHA-256），
+                                 同時代表購物車存在
+    store:cart:user:{uid}  string 使用者目前的購物車 id
+
+    每次寫入都會刷新 TTL，放著不動的購物車會自動過期
+    """
+
+    def __init__(self, client=None, timeout=None):
+        self.client = client or get_redis_connection('default')
+        self.timeout = timeout or getattr(settings, 'CART_TTL', 60 * 60 * 24 * 7)
+
+    def items_key(self, cart_id):
+        return f'store:cart:{cart_id}'
+
+    def price_key(self, cart_id):
+        return f'store:cart:{cart_id}:price'
+
+    def meta_key(self, cart_id):
+        return f'store:cart:{cart_id}:meta'
+
+    def user_key(self, user_id):
+        return f'store:cart:user:{user_id}'
+
+    def _expire(self, pipe, cart_id):
+        for key in (self.items_key(cart_id), self.price_key(cart_id),
+                    self.meta_key(cart_id)):
+            pipe.expire(key, self.timeout)
+
+    def create(self, user_id):
+        """
+        回傳 (cart_id, created)，使用者已經有購物車就沿用；
+        兩個請求同時建立時用 WATCH 讓其中一個重試，只會留下一台購物車
+        """
+        user_key = self.user_key(user_id)
+
+        def create_or_get(pipe):
+            cart_id = pipe.get(user_key)
+            # 對應的購物車過期了也要換掉，所以不能只用 SET NX
+            if cart_id is not None and pipe.exists(self.meta_key(cart_id.decode())):
+                return cart_id.decode(), False
+            cart_id = str(uuid4())
+            pipe.multi()
+            pipe.hset(self.meta_key(cart_id), 'user', user_id)
+            pipe.expire(self.meta_key(cart_id), self.timeout)
+            pipe.set(user_key, cart_id)
+            return cart_id, True
+
+        return self.client.transaction(create_or_get, user_key, value_from_callable=True)
+
+    def create_anonymous(self):
+        """未登入的購物車，回傳 (cart_id, token)；之後憑 token 存取，跟著 TTL 一起過期"""
+        cart_id = str(uuid4())
+        token = secrets.token_urlsafe(32)
+        pipe = self.client.pipeline()
+        pipe.hset(self.meta_key(cart_id), 'token', self._hash_token(token))
+        pipe.expire(self.meta_key(cart_id), self.timeout)
+        pipe.execute()
+        return cart_id, token
+
+    @staticmethod
+    def _hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def check_token(self, cart_id, token):
+        expected = self.client.hget(self.meta_key(cart_id), 'token')
+        return expected is not None and hmac.compare_digest(
+            expected.decode(), self._hash_token(token))
+
+    def claim(self, cart_id, user_id):
+        """登入後把匿名購物車的品項併進使用者的購物車，回傳使用者的購物車 id"""
+        user_cart_id, _ = self.create(user_id)
+        lines = [(item.product_id, item.quantity, item.price) for item in self.items(cart_id)]
+        if lines:
+            self.add_many(user_cart_id, lines)
+        self.delete(cart_id)
+        return user_cart_id
+
+    def get_user_cart(self, user_id):
+        cart_id = self.client.get(self.user_key(user_id))
+        if cart_id is None:
+            return None
+        cart_id = cart_id.decode()
+        # 購物車過期後這個對應就失效了
+        if not self.client.exists(self.meta_key(cart_id)):
+            return None
+        return cart_id
+
+    def get_owner(self, cart_id):
+        """購物車不存在時回傳 None"""
+        user_id = self.client.hget(self.meta_key(cart_id), 'user')
+        return user_id.decode() if user_id is not None else None
+
+    def add(self, cart_id, product_id, quantity, price):
+        return self.add_many(cart_id, [(product_id, quantity, price)])[0]
+
+    def add_many(self, cart_id, lines):
+        """lines: [(product_id, quantity, price), ...]，在同一個 MULTI 裡完成"""
+        pipe = self.client.pipeline()
+        for product_id, quantity, price in lines:
+            pipe.hincrby(self.items_key(cart_id), product_id, quantity)
+            pipe.hsetnx(self.price_key(cart_id), product_id, price)
+        self._expire(pipe, cart_id)
+        # 回傳每一行累加後的數量
+        return pipe.execute()[0:len(lines) * 2:2]
+
+    def set_quantity(self, cart_id, product_id, quantity):
+        if not self.client.hexists(self.items_key(cart_id), product_id):
+            return False
+        pipe = self.client.pipeline()
+        pipe.hset(self.items_key(cart_id), product_id, quantity)
+        self._expire(pipe, cart_id)
+        pipe.execute()
+        return True
+
+    def remove(self, cart_id, product_id):
+        pipe = self.client.pipeline()
+        pipe.hdel(self.items_key(cart_id), product_id)
+        pipe.hdel(self.price_key(cart_id), product_id)
+        self._expire(pipe, cart_id)
+        return bool(pipe.execute()[0])
+
+    def items(self, cart_id):
+        """回傳未存檔的 CartItem，id 用 product_id 代替"""
+        pipe = self.client.pipeline()
+        pipe.hgetall(self.items_key(cart_id))
+        pipe.hgetall(self.price_key(cart_id))
+        quantities, prices = pipe.execute()
+        return [
+            CartItem(id=int(product_id), cart_id=cart_id,
+                     product_id=int(product_id), quantity=int(quantity),
+                     price=int(prices.get(product_id, 0)))
+            for product_id, quantity in sorted(quantities.items(), key=lambda i: int(i[0]))
+        ]
+
+    def delete(self, cart_id):
+        user_id = self.get_owner(cart_id)
+        pipe = self.client.pipeline()
+        pipe.delete(self.items_key(cart_id), self.price_key(cart_id),
+                    self.meta_key(cart_id))
+        if user_id is not None:
+            pipe.delete(self.user_key(user_id))
+        pipe.execute()
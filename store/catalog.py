@@ -0,0 +1,216 @@
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from .caching import invalidate_versions
+from .models import Collection, Product
+from .search import index_products
+
+# 匯入 / 匯出的欄位，collection 用標題表示；sku 是比對既有產品用的 natural key
+PRODUCT_FIELDS = ['sku', 'title', 'description', 'price', 'inventory', 'collection']
+INT_FIELDS = {'price', 'inventory'}
+FORMATS = ['csv', 'ndjson']
+# 最多回報幾筆錯誤，避免整份壞掉的檔案把回應撐爆
+MAX_ERRORS = 100
+READ_BLOCK = 1024 * 1024
+
+
+def guess_format(filename, default='csv'):
+    if filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    if filename.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_rows(stream, file_format):
+    """逐行讀取文字串流，回傳 (行號, dict)，不會把整個檔案讀進記憶體"""
+    if file_format == 'csv':
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, row
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except (ValueError, RecursionError):
+                # 巢狀太深時 json.loads 丟 RecursionError，當成格式錯誤
+                row = None
+            yield line_no, row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class ProductImporter:
+    """
+    分批 bulk_create / bulk_update 產品：
+    每批只查一次既有 sku，collection 標題用一開始載入的對照表轉成 id
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = chunk_size
+        self.collections = {
+            title: pk for pk, title in Collection.objects.values_list('id', 'title')}
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+
+    def add_error(self, line_no, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'line': line_no, 'error': message})
+
+    def clean(self, line_no, row):
+        """回傳只含檔案裡有出現欄位的 dict，格式錯誤回傳 None"""
+        if not isinstance(row, dict):
+            self.add_error(line_no, '格式錯誤')
+            return None
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            self.add_error(line_no, '缺少 sku')
+            return None
+
+        if len(sku) > Product._meta.get_field('sku').max_length:
+            self.add_error(line_no, 'sku 太長')
+            return None
+
+        data = {'sku': sku}
+        for field in PRODUCT_FIELDS[1:]:
+            value = row.get(field)
+            if value is None or value == '':
+                continue
+            if field in INT_FIELDS:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    self.add_error(line_no, f'{field} 必須是整數')
+                    return None
+                if value < 0:
+                    self.add_error(line_no, f'{field} 不能是負數')
+                    return None
+            elif field == 'title':
+                value = str(value)
+                if len(value) > Product._meta.get_field('title').max_length:
+                    self.add_error(line_no, 'title 太長')
+                    return None
+            elif field == 'collection':
+                if not isinstance(value, str) or value not in self.collections:
+                    self.add_error(line_no, f'找不到 collection: {value}')
+                    return None
+                field, value = 'collection_id', self.collections[value]
+            data[field] = value
+        return data
+
+    def run(self, rows):
+        for chunk in chunked(rows, self.chunk_size):
+            self.import_chunk(chunk)
+        return {'created': self.created, 'updated': self.updated, 'errors': self.errors}
+
+    def import_chunk(self, chunk):
+        cleaned = {}
+        for line_no, row in chunk:
+            data = self.clean(line_no, row)
+            if data is not None:
+                # 同一批裡重複的 sku 以最後一筆為準
+                cleaned[data['sku']] = (line_no, data)
+
+        existing = {sku: (pk, collection_id) for sku, pk, collection_id in Product.objects.filter(
+            sku__in=cleaned.keys()).values_list('sku', 'id', 'collection_id')}
+        now = timezone.now()
+        to_create = []
+        # 依「有哪些欄位」分組，只更新檔案裡有的欄位（例如只改價格）
+        to_update = {}
+        for sku, (line_no, data) in cleaned.items():
+            if sku in existing:
+                fields = tuple(sorted(set(data) - {'sku'}))
+                if fields:
+                    to_update.setdefault(fields, []).append(
+                        Product(pk=existing[sku][0], update_date=now, **data))
+            elif set(PRODUCT_FIELDS[1:-1]) | {'collection_id'} <= set(data):
+                to_create.append(Product(**data))
+            else:
+                self.add_error(line_no, '新增產品需要所有欄位')
+
+        try:
+            with transaction.atomic():
+                created = Product.objects.bulk_create(to_create)
+                for fields, products in to_update.items():
+                    Product.objects.bulk_update(
+                        products, list(fields) + ['update_date'])
+        except (IntegrityError, DataError) as e:
+            # 這一批整個復原，回報行號範圍，繼續下一批
+            line_numbers = [line_no for line_no, _ in chunk]
+            self.add_error(line_numbers[0],
+                           f'第 {line_numbers[0]}-{line_numbers[-1]} 行未匯入: {e}')
+            return
+
+        # bulk 操作不會觸發 signal，自己讓快取失效
+        updated = [p for products in to_update.values() for p in products]
+        invalidate_versions('product', [p.pk for p in updated])
+        # 換了 collection 的產品，新舊兩個 collection 都要失效
+        old_collections = {existing[p.sku][1] for p in updated if p.collection_id}
+        invalidate_versions('collection', old_collections | {
+            p.collection_id for p in created + updated if p.collection_id})
+        # MySQL 的 bulk_create 不會回填 id，用 sku 查回來再送去索引
+        index_products(list(Product.objects.filter(
+            sku__in=[p.sku for p in created + updated]).values_list('id', flat=True)))
+
+        self.created += len(to_create)
+        self.updated += len(updated)
+
+
+def export_rows(chunk_size=2000):
+    """依 id 順序以 iterator 串流讀出，不建立 Product 物件"""
+    queryset = Product.objects.order_by('pk').values_list(
+        'sku', 'title', 'description', 'price', 'inventory', 'collection__title')
+    for values in queryset.iterator(chunk_size=chunk_size):
+        yield dict(zip(PRODUCT_FIELDS, values))
+
+
+class Echo:
+    """給 csv.writer 用的假檔案，write 直接回傳字串"""
+
+    def write(self, value):
+        return value
+
+
+def render_rows(rows, file_format):
+    """把 dict 串流轉成 CSV / NDJSON 文字串流"""
+    if file_format == 'csv':
+        writer = csv.DictWriter(Echo(), fieldnames=PRODUCT_FIELDS)
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def is_utf8(binary_file):
+    """
+    匯入前逐塊解碼檢查一次（不放進記憶體），編碼錯誤時整個檔案都不匯入；
+    檢查完把檔案位置移回開頭
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for block in iter(lambda: binary_file.read(READ_BLOCK), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    finally:
+        binary_file.seek(0)
+    return True
+
+
+def text_stream(binary_file):
+    return io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
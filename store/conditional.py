@@ -0,0 +1,103 @@
+import hashlib
+from calendar import timegm
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .caching import get_version, get_versions
+
+
+class ConditionalGetMixin:
+    """
+    list / retrieve 支援 If-None-Match / If-Modified-Since：
+    先用一個便宜的 aggregate（例如 max(update_date) + count）算出 ETag，
+    沒變就直接回 304，不做序列化。
+
+    設定 page_version_name 時，列表改從這一頁的資料列 + 每列的快取版本號算 ETag
+    （見 get_page_validators），不對整個表做 aggregate，第 N 頁的成本跟第 1 頁一樣；
+    retrieve 也只用版本號（見 get_detail_validators），不查資料庫
+    """
+    # store.caching 的版本名稱，例如 'product'
+    page_version_name = None
+
+    def get_validators(self):
+        """回傳 aggregate 的結果 dict，其中的 datetime 會拿來當 Last-Modified"""
+        raise NotImplementedError
+
+    def get_page_validators(self, page):
+        """
+        列表一頁的 validators：每列的 id、update_date 與版本號；
+        store.signals / store.inventory 在資料異動時 bump 版本號，
+        這一頁有任何一列改變、或換了一批資料列，ETag 都會不同
+        """
+        versions = get_versions(self.page_version_name, [obj.pk for obj in page])
+        validators = {'rows': [(obj.pk, versions[obj.pk]) for obj in page]}
+        modified = [obj.update_date for obj in page if getattr(obj, 'update_date', None)]
+        if modified:
+            validators['last_modified'] = max(modified)
+        return validators
+
+    def get_detail_validators(self):
+        """
+        retrieve 的 validators：物件的快取版本號，跟 VersionedCacheRetrieveMixin 的回應快取
+        用同一個，快取命中時整個請求不碰資料庫；取不到版本號時才用 get_validators 的 aggregate
+        """
+        if self.page_version_name is not None:
+            version = get_version(self.page_version_name, self.kwargs[self.lookup_field])
+            if version is not None:
+                return {'version': version}
+        return self.get_validators()
+
+    def get_conditional_headers(self, request, validators=None):
+        if validators is None:
+            validators = self.get_validators()
+        if validators is None:
+            return None, None
+        modified = [v for v in validators.values() if isinstance(v, datetime)]
+        last_modified = max(modified) if modified else None
+        # 同一份資料在不同網址（cursor、expand）或格式下回應內容不同
+        source = '|'.join([
+            repr(sorted(validators.items())),
+            request.get_host(),
+            request.get_full_path(),
+            request.accepted_media_type or '',
+        ])
+        etag = f'"{hashlib.md5(source.encode()).hexdigest()}"'
+        return etag, last_modified
+
+    def conditional_response(self, request, handler, *args, validators=None, **kwargs):
+        etag, last_modified = self.get_conditional_headers(request, validators)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response.headers['ETag'] = etag
+        if timestamp is not None:
+            response.headers['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if self.page_version_name is None:
+            return self.conditional_response(request, super().list, *args, **kwargs)
+
+        # 先查出這一頁（本來就要查），ETag 沒變就不序列化
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+
+        def render(request, *args, **kwargs):
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        return self.conditional_response(
+            request, render, *args, validators=self.get_page_validators(page), **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, super().retrieve, *args, validators=self.get_detail_validators(), **kwargs)
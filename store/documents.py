@@ -0,0 +1,28 @@
+from django_elasticsearch_dsl import Document, fields
+from django_elasticsearch_dsl.registries import registry
+from .models import Product
+
+
+@registry.register_document
+class ProductDocument(Document):
+    collection = fields.ObjectField(properties={
+        'id': fields.IntegerField(),
+        'title': fields.TextField(fields={'raw': fields.KeywordField()}),
+    })
+
+    class Index:
+        name = 'products'
+
+    class Django:
+        model = Product
+        fields = [
+            'title',
+            'description',
+            'price',
+            'inventory',
+        ]
+        # 由 store.signals 在 commit 後透過 store.search 更新，不走預設 signal
+        ignore_signals = True
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('collection')
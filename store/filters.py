@@ -0,0 +1,25 @@
+from rest_framework.filters import BaseFilterBackend
+
+
+class QueryParamFilter(BaseFilterBackend):
+    """
+    用 view.filter_serializer_class 驗證查詢參數，
+    驗證過的欄位直接當成 queryset.filter() 的 lookup，格式錯誤回 400
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        serializer_class = getattr(view, 'filter_serializer_class', None)
+        if serializer_class is None:
+            return queryset
+        params = serializer_class(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return queryset.filter(**params.validated_data)
+
+    def get_schema_operation_parameters(self, view):
+        serializer_class = getattr(view, 'filter_serializer_class', None)
+        if serializer_class is None:
+            return []
+        return [
+            {'name': name, 'required': False, 'in': 'query', 'schema': {'type': 'string'}}
+            for name in serializer_class().fields
+        ]
@@ -0,0 +1,107 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import Image, ImageOps
+
+from .models import ProductImage
+
+logger = logging.getLogger(__name__)
+
+# 衍生圖的寬度（px），比原圖寬的尺寸會略過
+VARIANT_WIDTHS = {'thumb': 150, 'small': 400, 'medium': 800, 'large': 1600}
+# 依偏好排序；AVIF 要 Pillow 有編譯進去才會產生
+VARIANT_FORMATS = ['avif', 'webp']
+QUALITY = {'avif': 60, 'webp': 80}
+
+_executor = None
+
+
+def available_formats():
+    extensions = Image.registered_extensions()
+    return [fmt for fmt in VARIANT_FORMATS if f'.{fmt}' in extensions]
+
+
+def variant_path(image, name, fmt):
+    return f'product/variants/{image.pk}/{name}.{fmt}'
+
+
+def render_variant(original, width, fmt):
+    variant = original.copy()
+    variant.thumbnail((width, width * 10), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    variant.save(buffer, format=fmt.upper(), quality=QUALITY[fmt])
+    return variant.size, buffer.getvalue()
+
+
+def generate_derivatives(image_id):
+    """
+    讀原圖，寫入各尺寸 / 格式的衍生圖，並把原圖與衍生圖的尺寸、大小存回 ProductImage；
+    用 save() 存回，會經過 store.signals 讓產品快取失效
+    """
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None:
+        return None
+
+    with image.image.open('rb') as file, Image.open(file) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ('RGB', 'RGBA'):
+            original = original.convert('RGBA' if 'A' in original.getbands() else 'RGB')
+        image.width, image.height = original.size
+        image.bytes = image.image.size
+
+        variants = []
+        for name, width in VARIANT_WIDTHS.items():
+            if width >= image.width:
+                continue
+            for fmt in available_formats():
+                (w, h), content = render_variant(original, width, fmt)
+                path = default_storage.save(
+                    variant_path(image, name, fmt), ContentFile(content))
+                variants.append({'name': name, 'format': fmt, 'path': path,
+                                 'width': w, 'height': h, 'bytes': len(content)})
+
+    # 檔名含內容雜湊，重新產生時要自己清掉舊的
+    stale = {v['path'] for v in image.variants} - {v['path'] for v in variants}
+    image.variants = variants
+    image.save(update_fields=['width', 'height', 'bytes', 'variants'])
+    for path in stale:
+        default_storage.delete(path)
+    return image
+
+
+def _run(image_id):
+    try:
+        generate_derivatives(image_id)
+    except Exception:
+        logger.exception('產生 ProductImage %s 衍生圖失敗', image_id)
+
+
+def _run_in_worker(image_id):
+    try:
+        _run(image_id)
+    finally:
+        # worker thread 自己的連線不會在 request 結束時被關掉
+        connections.close_all()
+
+
+def schedule_derivatives(image_id):
+    """IMAGE_DERIVATIVE_WORKERS = 0 時同步執行（測試 / 開發用）"""
+    global _executor
+    workers = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+    if not workers:
+        return _run(image_id)
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='image-derivatives')
+    return _executor.submit(_run_in_worker, image_id)
+
+
+def srcset(variants, fmt, url):
+    """url: path -> URL 的函式"""
+    return ', '.join(
+        f'{url(v["path"])} {v["width"]}w' for v in variants if v['format'] == fmt)
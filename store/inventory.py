@@ -0,0 +1,72 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import Product
+from .search import index_products
+
+
+class InsufficientInventory(Exception):
+    def __init__(self, shortfalls):
+        super().__init__('庫存不足')
+        # [{'product': id, 'requested': n, 'available': m}, ...]
+        self.shortfalls = shortfalls
+
+
+def _quantity_case(quantities):
+    return Case(
+        *[When(pk=product_id, then=Value(quantity))
+          for product_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def _invalidate(product_ids):
+    for product_id in product_ids:
+        bump_version('product', product_id)
+    # ?expand=products 的 collection 回應也帶有庫存
+    collection_ids = Product.objects.filter(pk__in=product_ids).values_list(
+        'collection_id', flat=True).distinct()
+    for collection_id in collection_ids:
+        bump_version('collection', collection_id)
+    index_products(product_ids)
+
+
+@transaction.atomic
+def reserve_inventory(quantities):
+    """
+    一次扣掉整張訂單的庫存，quantities 為 {product_id: 數量}
+
+    只發一句
+        UPDATE ... SET inventory = inventory - CASE id ... END
+        WHERE id IN (...) AND inventory >= CASE id ... END
+    不用 select_for_update，熱門商品的多筆結帳不會互相排隊等鎖。
+    只要有一行不夠就整批復原，並丟出 InsufficientInventory
+    """
+    quantities = {pk: n for pk, n in quantities.items() if n > 0}
+    if not quantities:
+        return
+
+    requested = _quantity_case(quantities)
+    sid = transaction.savepoint()
+    updated = Product.objects.filter(
+        pk__in=quantities.keys(), inventory__gte=requested
+    ).update(inventory=F('inventory') - requested, update_date=timezone.now())
+    if updated == len(quantities):
+        transaction.savepoint_commit(sid)
+        # update() 不會觸發 signal，自己讓產品快取失效
+        transaction.on_commit(lambda: _invalidate(list(quantities)))
+        return
+
+    # 有行數不夠：復原到扣庫存之前，再讀出實際庫存回報
+    transaction.savepoint_rollback(sid)
+    available = dict(Product.objects.filter(
+        pk__in=quantities.keys()).values_list('id', 'inventory'))
+    raise InsufficientInventory([
+        {'product': product_id,
+         'requested': quantity,
+         'available': max(available.get(product_id, 0), 0)}
+        for product_id, quantity in quantities.items()
+        if available.get(product_id, 0) < quantity
+    ])
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from store.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = '依 OrderItem.price 分批回填舊訂單的 subtotal / total'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        updated = 0
+
+        while True:
+            # 依 id 往後切，每批只處理 chunk_size 筆訂單
+            orders = list(Order.objects.filter(pk__gt=last_id).order_by(
+                'pk').only('pk', 'subtotal', 'total')[:chunk_size])
+            if not orders:
+                break
+            last_id = orders[-1].pk
+
+            subtotals = dict(OrderItem.objects.filter(
+                order_id__in=[o.pk for o in orders]
+            ).values('order_id').annotate(
+                subtotal=Sum(F('quantity') * F('price'))
+            ).values_list('order_id', 'subtotal'))
+
+            for order in orders:
+                order.set_totals(subtotals.get(order.pk))
+            with transaction.atomic():
+                Order.objects.bulk_update(orders, ['subtotal', 'total'])
+
+            updated += len(orders)
+            self.stdout.write(f'{updated} orders updated')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {updated} orders updated'))
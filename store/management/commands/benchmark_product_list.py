@@ -0,0 +1,130 @@
+import statistics
+import time
+from random import Random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from store.catalog import chunked
+from store.models import Collection, Product
+from store.views import ProductViewSet
+
+# 前端常用的篩選組合
+QUERIES = [
+    '',
+    '?collection_id={collection}',
+    '?price__gte=100&price__lte=200',
+    '?inventory__gt=0&ordering=price',
+    '?collection_id={collection}&price__lte=500',
+    '?update_date__gte=2020-01-01T00:00:00Z&ordering=-update_date',
+]
+
+
+class Command(BaseCommand):
+    help = ('量測 products/ 列表在大量資料下各種篩選 / 排序的延遲；'
+            '加上 --seed 才會把不夠的資料補齊（sku / 標題以 bench- 開頭），量完預設會刪掉')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='產品不夠 --products 時寫入 bench- 測試資料')
+        parser.add_argument('--keep', action='store_true', help='量完不刪除寫入的測試資料')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='寫入測試資料前不詢問')
+        parser.add_argument('--products', type=int, default=1_000_000)
+        parser.add_argument('--collections', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--explain', action='store_true',
+                            help='同時印出每個查詢的執行計畫')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.confirm(options)
+        try:
+            self.benchmark(self.seed(options), options)
+        finally:
+            if options['seed'] and not options['keep']:
+                self.cleanup(options)
+
+    def confirm(self, options):
+        if not options['interactive']:
+            return
+        name = connection.settings_dict['NAME']
+        answer = input(f"會在資料庫 {name!r} 寫入最多 {options['products']} 筆 bench- 產品，"
+                       f"量完{'保留' if options['keep'] else '刪除'}。輸入 'yes' 繼續：")
+        if answer != 'yes':
+            raise CommandError('已取消')
+
+    def benchmark(self, collections, options):
+        if not collections:
+            collections = list(Collection.objects.values_list('id', flat=True)[:1]) or [0]
+        view = ProductViewSet.as_view({'get': 'list'})
+        factory = APIRequestFactory()
+
+        self.stdout.write(f'{"query":<70} {"p50 ms":>8} {"p95 ms":>8}')
+        for query in QUERIES:
+            query = query.format(collection=collections[0])
+            timings = []
+            for _ in range(options['repeat']):
+                request = factory.get(f'/store/products/{query}')
+                start = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            self.stdout.write(
+                f'{query or "(none)":<70} {statistics.median(timings):>8.2f} {p95:>8.2f}')
+            if options['explain']:
+                self.stdout.write(self.explain(factory, query))
+
+    def seed(self, options):
+        if not options['seed']:
+            return []
+        collections = list(Collection.objects.filter(
+            title__startswith='bench-').values_list('id', flat=True))
+        for i in range(len(collections), options['collections']):
+            collections.append(Collection.objects.create(title=f'bench-{i}').id)
+
+        existing = Product.objects.count()
+        missing = options['products'] - existing
+        if missing <= 0:
+            return collections
+
+        self.stdout.write(f'Seeding {missing} products...')
+        random = Random(0)
+        rows = (
+            Product(sku=f'bench-{existing + i}', title=f'Product {existing + i:07d}',
+                    description='', price=random.randint(1, 1000),
+                    inventory=random.randint(0, 50),
+                    collection_id=random.choice(collections))
+            for i in range(missing)
+        )
+        for chunk in chunked(rows, options['chunk_size']):
+            Product.objects.bulk_create(chunk)
+        return collections
+
+    def cleanup(self, options):
+        """
+        分批刪掉 bench- 資料；直接下 DELETE，不經過 signal
+        （逐筆 bump 快取版本、從 ES 移除，而這些資料本來就沒進索引）
+        """
+        products = Product.objects.filter(sku__startswith='bench-').values_list('pk', flat=True)
+        deleted = 0
+        while ids := list(products[:options['chunk_size']]):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {Product._meta.db_table} '
+                    f'WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+            deleted += len(ids)
+        Collection.objects.filter(title__startswith='bench-', product__isnull=True).delete()
+        self.stdout.write(f'Deleted {deleted} seeded products')
+
+    def explain(self, factory, query):
+        view = ProductViewSet(action_map={'get': 'list'}, args=(), kwargs={}, format_kwarg=None)
+        view.request = view.initialize_request(factory.get(f'/store/products/{query}'))
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        ordering = paginator.resolve_ordering(view.request, queryset, view)
+        return queryset.order_by(*ordering)[:paginator.page_size + 1].explain()
@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from pyshop.uploads import UPLOAD_TTL, ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = '刪除已經過期、沒有完成的分段上傳暫存檔（見 pyshop.uploads.ChunkedUpload）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=UPLOAD_TTL,
+                            help='超過多少秒沒有寫入才刪除')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        deleted = 0
+        freed = 0
+        for path, size in ChunkedUpload.expired_parts(max_age=options['max_age']):
+            if not options['dry_run']:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+            deleted += 1
+            freed += size
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{action} {deleted} parts, {freed} bytes'))
@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from store.catalog import FORMATS, export_rows, guess_format, render_rows
+
+
+class Command(BaseCommand):
+    help = '將產品串流匯出成 CSV / NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='預設輸出到 stdout')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or guess_format(output or '')
+        chunks = render_rows(export_rows(options['chunk_size']), file_format)
+
+        if output is None:
+            sys.stdout.writelines(chunks)
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as stream:
+            stream.writelines(chunks)
+        self.stdout.write(self.style.SUCCESS(f'Exported to {output}'))
@@ -0,0 +1,38 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog import chunked
+
+
+class Command(BaseCommand):
+    help = '分批刪除沒有任何檔名指向的 blob（見 pyshop.storage.ContentAddressedStorage）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--grace', type=int, default=60 * 60,
+                            help='跳過多少秒內寫入的 blob')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if not hasattr(default_storage, 'unreferenced_blobs'):
+            raise CommandError('default storage 不是 ContentAddressedStorage')
+
+        deleted = 0
+        freed = 0
+        blobs = default_storage.unreferenced_blobs(grace=options['grace'])
+        for batch in chunked(blobs, options['batch_size']):
+            for path, size in batch:
+                if not options['dry_run']:
+                    # 就算剛好有新上傳 link 到這個 blob，資料仍在它的 link 上，只是之後不再共用
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                deleted += 1
+                freed += size
+            self.stdout.write(f'{deleted} blobs, {freed} bytes')
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{action} {deleted} blobs, {freed} bytes'))
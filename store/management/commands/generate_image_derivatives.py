@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store.images import generate_derivatives
+from store.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = '為既有的產品圖片產生縮圖 / WebP 衍生圖'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='連已經有衍生圖的也重新產生')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('pk')
+        if not options['all']:
+            images = images.filter(width__isnull=True)
+
+        done = 0
+        for image_id in images.values_list('pk', flat=True).iterator():
+            generate_derivatives(image_id)
+            done += 1
+            if done % 100 == 0:
+                self.stdout.write(f'{done} images processed')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {done} images processed'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog import FORMATS, ProductImporter, guess_format, read_rows
+
+
+class Command(BaseCommand):
+    help = '從 CSV / NDJSON 分批匯入產品，依 sku 新增或更新'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        importer = ProductImporter(chunk_size=options['chunk_size'])
+
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                result = importer.run(read_rows(stream, file_format))
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(e)
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {result['created']} created, {result['updated']} updated, "
+            f"{len(result['errors'])} errors"))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = '從 Review 分批重算產品的評論統計，修正增量更新的誤差'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        updated = 0
+
+        while True:
+            ids = list(Product.objects.filter(pk__gt=last_id).order_by(
+                'pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                updated += Product.objects.filter(pk__in=ids).refresh_review_stats()
+            self.stdout.write(f'{updated} products updated')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {updated} products updated'))
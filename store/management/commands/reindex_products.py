@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+from store.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = '重建產品搜尋索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = Product.objects.select_related('collection').order_by('pk')
+        get_search_backend().rebuild(queryset, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Done, {queryset.count()} products indexed'))
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_order_subtotal_order_total'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='orderitem',
+            unique_together={('order', 'product')},
+        ),
+    ]
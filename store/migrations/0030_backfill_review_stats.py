@@ -0,0 +1,42 @@
+from django.db import migrations
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+CHUNK_SIZE = 1000
+
+
+def backfill_review_stats(apps, schema_editor):
+    """
+    評論統計改成增量更新，既有產品的 review_count / rating_count / rating_sum
+    要先從 Review 重算一次（同 ProductQuerySet.refresh_review_stats），分批更新
+    """
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    last_id = 0
+    while True:
+        ids = list(Product.objects.filter(pk__gt=last_id).order_by(
+            'pk').values_list('pk', flat=True)[:CHUNK_SIZE])
+        if not ids:
+            break
+        last_id = ids[-1]
+        Product.objects.filter(pk__in=ids).update(
+            review_count=Coalesce(Subquery(
+                reviews.annotate(count=Count('id')).values('count')), 0),
+            rating_count=Coalesce(Subquery(
+                reviews.annotate(count=Count('rating')).values('count')), 0),
+            rating_sum=Coalesce(Subquery(
+                reviews.annotate(total=Sum('rating')).values('total')), 0),
+            rating_avg=Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0029_product_rating_sum'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_review_stats, migrations.RunPython.noop),
+    ]
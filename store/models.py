@@ -1,8 +1,14 @@
-from django.db import models
+from django.db import connections, models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, AbstractUser
-from django.core.validators import MinValueValidator
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db.models import Avg, Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from decimal import ROUND_HALF_UP, Decimal
 from uuid import uuid4
 
+# 含稅價格 = 未稅價格 * TAX_RATE；用 Decimal 避免浮點誤差
+TAX_RATE = Decimal('1.1')
+
 # 更改系統的 createuser
 
 
@@ -73,34 +79,99 @@ class Address(models.Model):
 
 class Collection(models.Model):
     title = models.CharField(max_length=255)
+    update_date = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # KeysetPagination 依 (title, id) 排序與比較
+            models.Index(fields=['title', 'id']),
+        ]
+
+
+class ProductQuerySet(models.QuerySet):
+    def add_review_stats(self, reviews=0, ratings=0, rating_sum=0):
+        """
+        依差值更新評論統計（新增評論 +1、刪除 -1、改評分只動 rating_sum），
+        用 F() 在同一個 UPDATE 裡算，不重新 COUNT / AVG 整個產品的評論
+        """
+        rating_count = models.F('rating_count') + ratings
+        return self.update(
+            # MySQL 的 UPDATE 由左到右套用，rating_avg 放第一個才會讀到更新前的值
+            rating_avg=models.Case(
+                models.When(rating_count__gt=-ratings, then=Cast(
+                    models.F('rating_sum') + rating_sum, models.FloatField()) / rating_count),
+                default=None),
+            review_count=models.F('review_count') + reviews,
+            rating_count=rating_count,
+            rating_sum=models.F('rating_sum') + rating_sum,
+        )
+
+    def refresh_review_stats(self):
+        """
+        用一個 UPDATE 從 Review 完整重算評論統計；
+        平常由 add_review_stats 增量維護，這個給 recompute_review_stats 修正誤差
+        """
+        reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.update(
+            review_count=Coalesce(Subquery(
+                reviews.annotate(count=Count('id')).values('count')), 0),
+            rating_count=Coalesce(Subquery(
+                reviews.annotate(count=Count('rating')).values('count')), 0),
+            rating_sum=Coalesce(Subquery(
+                reviews.annotate(total=Sum('rating')).values('total')), 0),
+            rating_avg=Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+        )
 
 
 class Product(models.Model):
     # ForeignKey(1->many)
     collection = models.ForeignKey(
         Collection, on_delete=models.PROTECT)
+    # 匯入 / 匯出比對用的 natural key
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     title = models.CharField(max_length=255)
     description = models.TextField()
     price = models.IntegerField()
     inventory = models.IntegerField()
-    update_date = models.DateField(auto_now=True)
+    update_date = models.DateTimeField(auto_now=True)
+    # 反正規化的評論統計，由 store.signals 維護，列表不用再查 Review
+    review_count = models.PositiveIntegerField(default=0)
+    rating_avg = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True)
+    # 有評分的評論數與評分總和，增量更新 rating_avg 用
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # KeysetPagination 依 (title, id) 排序與比較
+            models.Index(fields=['title', 'id']),
+            # ?collection_id= 篩選後照預設排序分頁
+            models.Index(fields=['collection', 'title', 'id']),
+            # ?price__gte / ?ordering=price 與 ?update_date__gte / ?ordering=update_date
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['update_date', 'id']),
+        ]
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='product/')
+    # 以下由 store.images 在上傳後於背景產生
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    # [{'name', 'format', 'path', 'width', 'height', 'bytes'}, ...]
+    variants = models.JSONField(default=list, blank=True)
 
 
 class Review(models.Model):
@@ -109,8 +180,77 @@ class Review(models.Model):
         Product, on_delete=models.CASCADE, related_name='reviews')
     name = models.CharField(max_length=255)
     description = models.TextField()
+    # 舊評論沒有評分，不列入 rating_avg
+    rating = models.PositiveSmallIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(5)])
     date = models.DateField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # ReviewPagination 依 (date, id) 由新到舊分頁
+            models.Index(fields=['product', 'date', 'id']),
+        ]
+
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        # 在資料庫算好購物車總額與品項數，不用把產品載入 Python 加總
+        return self.annotate(
+            total_price=Coalesce(models.Sum(
+                models.F('cartitem__quantity') * models.F('cartitem__product__price')
+            ), 0),
+            item_count=Coalesce(models.Sum('cartitem__quantity'), 0),
+        )
+
+
+class QuantityUpsertQuerySet(models.QuerySet):
+    """
+    以 Meta.unique_together 為鍵做 upsert，已存在就把 quantity 累加上去：
+    MySQL 用 ON DUPLICATE KEY UPDATE，SQLite / PostgreSQL 用 ON CONFLICT。
+    一句 SQL 完成，不會有讀出來再寫回去的 lost update
+    """
+
+    def add_quantities(self, rows):
+        """rows: [{'cart_id': ..., 'product_id': ..., 'quantity': ..., 'price': ...}, ...]"""
+        if not rows:
+            return
+        opts = self.model._meta
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+
+        fields = [opts.get_field(name) for name in rows[0]]
+        table = qn(opts.db_table)
+        columns = ', '.join(qn(f.column) for f in fields)
+        row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        values = ', '.join([row_sql] * len(rows))
+        params = [f.get_db_prep_save(row[f.attname], connection)
+                  for row in rows for f in fields]
+        quantity = qn(opts.get_field('quantity').column)
+
+        if connection.vendor == 'mysql':
+            conflict = f'ON DUPLICATE KEY UPDATE {quantity} = {quantity} + VALUES({quantity})'
+        else:
+            keys = ', '.join(qn(opts.get_field(name).column)
+                             for name in opts.unique_together[0])
+            conflict = (f'ON CONFLICT ({keys}) DO UPDATE SET '
+                        f'{quantity} = {table}.{quantity} + EXCLUDED.{quantity}')
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES {values} {conflict}', params)
+
+
+class CartItemQuerySet(QuantityUpsertQuerySet):
+    def add_quantity(self, cart_id, product, quantity):
+        # 價格只在第一次加入時寫入
+        self.add_quantities([{'cart_id': cart_id, 'product_id': product.pk,
+                              'quantity': quantity, 'price': product.price}])
+        return self.get(cart_id=cart_id, product=product)
+
+    def with_line_total(self):
+        return self.annotate(
+            line_total=models.F('quantity') * models.F('product__price'))
+
 
 class Cart(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4)
@@ -119,6 +259,8 @@ class Cart(models.Model):
         Customer, null=True, blank=True, on_delete=models.CASCADE
     )
 
+    objects = CartQuerySet.as_manager()
+
 
 class CartItem(models.Model):
     # ForeignKey(1->many)
@@ -132,6 +274,8 @@ class CartItem(models.Model):
     )
     price = models.IntegerField()
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = [['cart', 'product']]
 
@@ -147,6 +291,28 @@ class Order(models.Model):
         'Address', null=True, blank=True, on_delete=models.SET_NULL, related_name='orders')
     status = models.CharField(max_length=1, choices=status, default='P')
     placed_at = models.DateField(auto_now=True)
+    # 下單時依 OrderItem.price 算好存起來，讀取訂單不用再逐項加總
+    subtotal = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+    def set_totals(self, subtotal):
+        self.subtotal = subtotal or 0
+        # 四捨五入到整數（round() 是銀行家捨入）
+        self.total = int((self.subtotal * TAX_RATE).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+    def recompute_totals(self):
+        subtotal = self.orderitem_set.aggregate(
+            subtotal=models.Sum(models.F('quantity') * models.F('price'))
+        )['subtotal']
+        self.set_totals(subtotal)
+        self.save(update_fields=['subtotal', 'total'])
+
+
+class OrderItemQuerySet(QuantityUpsertQuerySet):
+    def add_quantity(self, order_id, product, quantity):
+        self.add_quantities([{'order_id': order_id, 'product_id': product.pk,
+                              'quantity': quantity, 'price': product.price}])
+        return self.get(order_id=order_id, product=product)
 
 
 class OrderItem(models.Model):
@@ -156,4 +322,9 @@ class OrderItem(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE)
     quantity = models.PositiveSmallIntegerField()
-    price = models.IntegerField()
\ No newline at end of file
+    price = models.IntegerField()
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [['order', 'product']]
\ No newline at end of file
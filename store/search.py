@@ -0,0 +1,202 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# ES 的 index.max_result_window 預設值，from + size 超過會被拒絕
+MAX_RESULT_WINDOW = 10000
+# price_ranges facet 的區間，None 代表不設上 / 下限
+PRICE_RANGES = [(None, 100), (100, 500), (500, 1000), (1000, None)]
+
+
+def get_search_backend():
+    """settings.PRODUCT_SEARCH_BACKEND = 'elasticsearch' 或 'memory'"""
+    if getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'elasticsearch') == 'memory':
+        return InMemoryProductSearch()
+    return ElasticsearchProductSearch()
+
+
+def product_to_doc(product):
+    return {
+        'id': product.pk,
+        'title': product.title,
+        'description': product.description,
+        'price': product.price,
+        'inventory': product.inventory,
+        'collection': {'id': product.collection_id, 'title': product.collection.title},
+    }
+
+
+def price_range_key(low, high):
+    return f"{'*' if low is None else low}-{'*' if high is None else high}"
+
+
+def in_price_range(price, low, high):
+    return (low is None or price >= low) and (high is None or price < high)
+
+
+class ElasticsearchProductSearch:
+    def get_document(self):
+        from .documents import ProductDocument
+        return ProductDocument
+
+    def search(self, query='', price_gte=None, price_lte=None, collection=None,
+               offset=0, size=20):
+        search = self.get_document().search()
+        if query:
+            search = search.query(
+                'multi_match', query=query,
+                fields=['title^2', 'description', 'collection.title'])
+
+        # 篩選放在 post_filter，facet 才會顯示篩選前的各區間數量
+        if price_gte is not None or price_lte is not None:
+            price = {k: v for k, v in (('gte', price_gte), ('lte', price_lte)) if v is not None}
+            search = search.post_filter('range', price=price)
+        if collection is not None:
+            search = search.post_filter('term', **{'collection.id': collection})
+
+        search.aggs.bucket(
+            'collections', 'terms', field='collection.id', size=50
+        ).metric('title', 'top_hits', size=1, _source=['collection.title'])
+        search.aggs.bucket('price_ranges', 'range', field='price', keyed=False, ranges=[
+            {k: v for k, v in (('from', low), ('to', high)) if v is not None}
+            for low, high in PRICE_RANGES
+        ])
+
+        response = search[offset:offset + size].execute()
+        aggs = response.aggregations
+        return {
+            'count': response.hits.total.value,
+            'results': [{'id': int(hit.meta.id), **hit.to_dict()} for hit in response],
+            'facets': {
+                'collections': [{
+                    'id': bucket.key,
+                    'title': bucket.title.hits.hits[0]['_source']['collection']['title'],
+                    'count': bucket.doc_count,
+                } for bucket in aggs.collections.buckets],
+                'price_ranges': [{
+                    'key': price_range_key(low, high),
+                    'count': bucket.doc_count,
+                } for (low, high), bucket in zip(PRICE_RANGES, aggs.price_ranges.buckets)],
+            },
+        }
+
+    def update(self, products):
+        self.get_document()().update(products)
+
+    def delete(self, product_ids):
+        document = self.get_document()
+        # delete 只需要 pk
+        document().update([Product(pk=pk) for pk in product_ids],
+                          action='delete', raise_on_error=False)
+
+    def rebuild(self, queryset, chunk_size=1000):
+        """
+        寫進一個新的索引（products-<時間>），完成後把 products alias 一次切過去，
+        重建期間搜尋仍查舊索引；切換後補上重建期間更新過的產品，再刪掉舊索引
+        """
+        document = self.get_document()
+        alias = document._index._name
+        client = document._get_connection()
+        started = timezone.now()
+        name = f'{alias}-{started:%Y%m%d%H%M%S%f}'
+        index = document._index.clone(name=name)
+        index.create()
+        actions = ({**action, '_index': name} for action in document().get_actions(
+            queryset.iterator(chunk_size=chunk_size), 'index'))
+        # 重建時不需要每批 refresh
+        document().bulk(actions, chunk_size=chunk_size, refresh=False)
+        index.refresh()
+
+        old_indices = []
+        switch = [{'add': {'index': name, 'alias': alias}}]
+        if client.indices.exists_alias(name=alias):
+            old_indices = list(client.indices.get_alias(name=alias))
+            switch += [{'remove': {'index': old, 'alias': alias}} for old in old_indices]
+        elif client.indices.exists(index=alias):
+            # 舊版直接用 products 當索引名稱，要跟加 alias 在同一個操作裡刪掉
+            switch.append({'remove_index': {'index': alias}})
+        client.indices.update_aliases(actions=switch)
+        for old in old_indices:
+            client.indices.delete(index=old, ignore_unavailable=True)
+
+        # 重建期間的寫入只進了舊索引
+        document().update(queryset.filter(update_date__gte=started).iterator(
+            chunk_size=chunk_size))
+
+
+class InMemoryProductSearch:
+    """沒有 ES node 時（本機開發、測試）使用，行為盡量與 ES 版一致"""
+    documents = {}
+
+    def search(self, query='', price_gte=None, price_lte=None, collection=None,
+               offset=0, size=20):
+        terms = query.lower().split()
+
+        def matches(doc):
+            text = ' '.join([doc['title'], doc['description'],
+                             doc['collection']['title']]).lower()
+            return all(term in text for term in terms)
+
+        matched = sorted((d for d in self.documents.values() if matches(d)),
+                         key=lambda d: (d['title'], d['id']))
+        filtered = [
+            d for d in matched
+            if (price_gte is None or d['price'] >= price_gte)
+            and (price_lte is None or d['price'] <= price_lte)
+            and (collection is None or d['collection']['id'] == collection)
+        ]
+
+        collections = {}
+        for doc in matched:
+            facet = collections.setdefault(doc['collection']['id'], {
+                'id': doc['collection']['id'],
+                'title': doc['collection']['title'],
+                'count': 0,
+            })
+            facet['count'] += 1
+
+        return {
+            'count': len(filtered),
+            'results': filtered[offset:offset + size],
+            'facets': {
+                'collections': sorted(collections.values(), key=lambda f: -f['count']),
+                'price_ranges': [{
+                    'key': price_range_key(low, high),
+                    'count': sum(in_price_range(d['price'], low, high) for d in matched),
+                } for low, high in PRICE_RANGES],
+            },
+        }
+
+    def update(self, products):
+        for product in products:
+            self.documents[product.pk] = product_to_doc(product)
+
+    def delete(self, product_ids):
+        for pk in product_ids:
+            self.documents.pop(pk, None)
+
+    def rebuild(self, queryset, chunk_size=1000):
+        self.documents.clear()
+        self.update(queryset.iterator(chunk_size=chunk_size))
+
+
+def index_products(product_ids):
+    """store.signals 在 commit 後呼叫；索引失敗只記 log，不影響寫入"""
+    products = Product.objects.select_related('collection').filter(pk__in=product_ids)
+    try:
+        get_search_backend().update(list(products))
+    except Exception:
+        logger.exception('Failed to index products %s', product_ids)
+
+
+def unindex_products(product_ids):
+    try:
+        get_search_backend().delete(product_ids)
+    except Exception:
+        logger.exception('Failed to remove products %s from index', product_ids)
+
@@ -1,6 +1,13 @@
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import Exists
 from rest_framework import serializers
-from .models import Collection, Product, Review, Cart, CartItem, Customer, Order, OrderItem, ProductImage, Address
+from rest_framework.reverse import reverse
+from .carts import get_cart_store
+from .images import srcset
+from .inventory import reserve_inventory
+from .search import MAX_RESULT_WINDOW
+from .models import TAX_RATE, Collection, Product, Review, Cart, CartItem, Customer, Order, OrderItem, ProductImage, Address
 
 
 class AddressSerializer(serializers.ModelSerializer):
@@ -33,7 +40,21 @@ class CustomerSerializer(serializers.ModelSerializer):
 class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'width', 'height', 'bytes', 'srcset']
+        read_only_fields = ['width', 'height', 'bytes']
+
+    # 衍生圖還沒產生前是空的，前端退回用 image
+    srcset = serializers.SerializerMethodField()
+
+    def get_srcset(self, image: ProductImage):
+        request = self.context.get('request')
+
+        def url(path):
+            url = default_storage.url(path)
+            return request.build_absolute_uri(url) if request else url
+
+        return {fmt: srcset(image.variants, fmt, url)
+                for fmt in {v['format'] for v in image.variants}}
 
     def create(self, validated_data):
         product_id = self.context['product_id']
@@ -43,7 +64,7 @@ class ProductImageSerializer(serializers.ModelSerializer):
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ['id', 'name', 'description', 'date']
+        fields = ['id', 'name', 'description', 'rating', 'date']
 
     def create(self, validated_data):
         product_id = self.context['product_id']
@@ -53,22 +74,68 @@ class ReviewSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'title', 'description',
-                  'price', 'price_tax', 'inventory', 'collection', 'productimage_set']
+        fields = ['id', 'sku', 'title', 'description',
+                  'price', 'price_tax', 'inventory', 'collection', 'productimage_set',
+                  'review_count', 'rating_avg']
+        read_only_fields = ['review_count', 'rating_avg']
     productimage_set = ProductImageSerializer(many=True, read_only=True)
     price_tax = serializers.SerializerMethodField(method_name='calculateTax')
 
     def calculateTax(self, product: Product):
-        return product.price * 1.1
+        return product.price * TAX_RATE
+
+
+class ProductSearchSerializer(serializers.Serializer):
+    """products/search/ 的查詢參數"""
+    q = serializers.CharField(required=False, default='', source='query')
+    price_gte = serializers.IntegerField(required=False, min_value=0)
+    price_lte = serializers.IntegerField(required=False, min_value=0)
+    collection = serializers.IntegerField(required=False)
+    offset = serializers.IntegerField(required=False, default=0, min_value=0,
+                                      max_value=MAX_RESULT_WINDOW)
+    size = serializers.IntegerField(required=False, default=20, min_value=1, max_value=100)
+
+    def validate(self, attrs):
+        # ES 會拒絕 from + size 超過 max_result_window 的查詢
+        if attrs['offset'] + attrs['size'] > MAX_RESULT_WINDOW:
+            raise serializers.ValidationError(
+                {'offset': f'offset + size 不能超過 {MAX_RESULT_WINDOW}'})
+        return attrs
+
+
+class ProductFilterSerializer(serializers.Serializer):
+    """products/ 列表的篩選參數，欄位名稱就是 ORM lookup（見 store.filters）"""
+    collection_id = serializers.IntegerField(required=False)
+    price__gte = serializers.IntegerField(required=False)
+    price__lte = serializers.IntegerField(required=False)
+    inventory__gt = serializers.IntegerField(required=False)
+    update_date__gte = serializers.DateTimeField(required=False)
+    update_date__lte = serializers.DateTimeField(required=False)
 
 
 class CollectionSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(
-        many=True, read_only=True, source="product_set")
+    # 由 CollectionViewSet.get_queryset 的 annotate 提供，新建時沒有就是 0
+    products_count = serializers.IntegerField(read_only=True, default=0)
 
     class Meta:
         model = Collection
-        fields = ["id", "title", "products"]
+        fields = ["id", "title", "products_count"]
+
+
+class CollectionExpandSerializer(CollectionSerializer):
+    """?expand=products 時使用，只帶每個 collection 的第一頁產品"""
+    products = ProductSerializer(
+        many=True, read_only=True, source="preview_products")
+    products_url = serializers.SerializerMethodField()
+
+    class Meta(CollectionSerializer.Meta):
+        fields = CollectionSerializer.Meta.fields + ["products", "products_url"]
+
+    def get_products_url(self, collection: Collection):
+        # 超過第一頁的產品改由 collections/{id}/products/ 分頁取得
+        return reverse('collection-products-list',
+                       kwargs={'collection_pk': collection.pk},
+                       request=self.context.get('request'))
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -79,34 +146,66 @@ class CartItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cartitem: CartItem):
-        return cartitem.quantity * cartitem.product.price
+        # 優先使用 CartItemQuerySet.with_line_total 的結果
+        line_total = getattr(cartitem, 'line_total', None)
+        if line_total is None:
+            line_total = cartitem.quantity * cartitem.product.price
+        return line_total
 
     def create(self, validated_data):
         # 從前端輸入的 product_id 查詢產品
         product = validated_data['product']
         quantity = validated_data['quantity']
         cart_id = self.context.get('cart_id')
-        price = product.price
-
-        cart_item, created = CartItem.objects.get_or_create(
-            cart_id=cart_id,
-            product=product,
-            defaults={'quantity': quantity, 'price': price}
-        )
-
-        # 如果已經存在，則只增加數量
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
 
-        return cart_item
+        # 不存在就新增，已經存在則在資料庫裡原子地增加數量
+        return CartItem.objects.add_quantity(cart_id, product, quantity)
 
     def update(self, instance, validated_data):
         instance.quantity = validated_data.get('quantity', instance.quantity)
-        instance.save()
+        instance.save(update_fields=['quantity'])
+        # 查詢時 annotate 的 line_total 是更新前的數量算的
+        instance.__dict__.pop('line_total', None)
         return instance
 
 
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
+
+
+class CartItemBulkSerializer(serializers.Serializer):
+    """一次加入多個產品：{"items": [{"product": 1, "quantity": 2}, ...]}"""
+    items = CartLineSerializer(many=True, allow_empty=False, max_length=100)
+
+    def validate_items(self, items):
+        # 同一個產品出現多次就合併數量
+        quantities = {}
+        for line in items:
+            quantities[line['product']] = quantities.get(
+                line['product'], 0) + line['quantity']
+
+        # 所有產品用一次 IN 查詢確認
+        products = Product.objects.only('id', 'price').in_bulk(quantities.keys())
+        missing = sorted(set(quantities) - set(products))
+        if missing:
+            raise serializers.ValidationError(f'找不到產品: {missing}')
+
+        return [{'product': products[product_id], 'quantity': quantity}
+                for product_id, quantity in quantities.items()]
+
+    def save(self, **kwargs):
+        cart_id = self.context['cart_id']
+        items = self.validated_data['items']
+        with transaction.atomic():
+            CartItem.objects.add_quantities([
+                {'cart_id': cart_id, 'product_id': line['product'].pk,
+                 'quantity': line['quantity'], 'price': line['product'].price}
+                for line in items
+            ])
+        return [line['product'].pk for line in items]
+
+
 class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
@@ -118,7 +217,21 @@ class CartSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, cart: Cart):
-        return sum([i.quantity*i.product.price for i in cart.cartitem_set.all()])
+        # 優先使用 CartQuerySet.with_totals 的結果
+        total_price = getattr(cart, 'total_price', None)
+        if total_price is None:
+            total_price = sum([i.quantity*i.product.price for i in cart.cartitem_set.all()])
+        return total_price
+
+
+class CartSummarySerializer(serializers.ModelSerializer):
+    """只用 with_totals 的 annotate 結果，不載入任何品項或產品"""
+    class Meta:
+        model = Cart
+        fields = ['id', 'item_count', 'total_price']
+
+    item_count = serializers.IntegerField(read_only=True)
+    total_price = serializers.IntegerField(read_only=True)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -130,75 +243,104 @@ class OrderItemSerializer(serializers.ModelSerializer):
     total_price = serializers.SerializerMethodField()
 
     def get_total_price(self, orderitem: OrderItem):
-        return orderitem.quantity * orderitem.product.price
+        # 用下單當時記下的價格，不是產品目前的價格
+        return orderitem.quantity * orderitem.price
 
     def create(self, validated_data):
         # 從前端輸入的 product_id 查詢產品
         product = validated_data['product']
         quantity = validated_data['quantity']
         order_id = self.context.get('order_id')
-        price = product.price
-
-        # 嘗試查詢是否已經存在這個 order_item
-        # 如果是創建，則使用這些初始值
-        order_item, created = OrderItem.objects.get_or_create(
-            order_id=order_id,
-            product=product,
-            defaults={'quantity': quantity, 'price': price}
-        )
 
-        # 如果已經存在，則只增加數量
-        if not created:
-            order_item.quantity += quantity
-            order_item.save()
+        # 不存在就新增，已經存在則在資料庫裡原子地增加數量
+        order_item = OrderItem.objects.add_quantity(order_id, product, quantity)
 
+        order_item.order.recompute_totals()
         return order_item
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderListSerializer(serializers.ModelSerializer):
+    """訂單列表只讀 Order 本身，金額用下單時存好的欄位"""
     class Meta:
         model = Order
         fields = ['id', 'customer', 'status', 'placed_at',
-                  'orderitem_set', 'total_price', 'shipping_address']
+                  'subtotal', 'total', 'total_price', 'shipping_address']
+    total_price = serializers.IntegerField(source='subtotal', read_only=True)
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['id', 'customer', 'status', 'placed_at', 'orderitem_set',
+                  'subtotal', 'total', 'total_price', 'shipping_address']
     orderitem_set = OrderItemSerializer(many=True, read_only=True)
-    total_price = serializers.SerializerMethodField()
+    total_price = serializers.IntegerField(source='subtotal', read_only=True)
     shipping_address = AddressSerializer()
 
-    def get_total_price(self, order: Order):
-        return sum([i.quantity*i.product.price for i in order.orderitem_set.all()])
-
 
 class OrderCreateSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField()
     shipping_address_id = serializers.IntegerField()
 
-    def validate_cart_id(self, cart_id):
-        if not Cart.objects.filter(pk=cart_id).exists():
-            raise serializers.ValidationError('此 cart_id 不存在')
-        if CartItem.objects.filter(cart_id=cart_id).count() == 0:
-            raise serializers.ValidationError('無cartitem, 無法加入')
-        return cart_id
+    def validate(self, attrs):
+        address_owned = Address.objects.filter(
+            pk=attrs['shipping_address_id'],
+            customer_id=self.context['customer_id'])
+
+        cart_store = get_cart_store()
+        if cart_store is not None:
+            # Redis 購物車：品項從 Redis 讀，地址另外確認；別人的購物車當作不存在
+            owned = cart_store.get_owner(attrs['cart_id']) == str(self.context['customer_id'])
+            cartitem_set = cart_store.items(attrs['cart_id']) if owned else []
+            address_ok = bool(cartitem_set) and address_owned.exists()
+        else:
+            # 一次查詢：載入自己購物車的內容（含產品），同時確認收件地址屬於下單的人
+            cartitem_set = list(CartItem.objects.select_related('product').filter(
+                cart_id=attrs['cart_id'], cart__user_id=self.context['customer_id']
+            ).annotate(address_owned=Exists(address_owned)))
+            address_ok = bool(cartitem_set) and cartitem_set[0].address_owned
+
+        if not cartitem_set:
+            raise serializers.ValidationError(
+                {'cart_id': '此 cart_id 不存在或無cartitem, 無法加入'})
+        if not address_ok:
+            raise serializers.ValidationError(
+                {'shipping_address_id': '找不到此收件地址'})
+
+        attrs['cartitem_set'] = cartitem_set
+        return attrs
 
     def save(self, **kwargs):
         with transaction.atomic():
             cart_id = self.validated_data['cart_id']
             shipping_address_id = self.validated_data['shipping_address_id']
-            cartitem_set = CartItem.objects.select_related(
-                'product').filter(cart_id=cart_id)
-            order = Order.objects.create(
+            cartitem_set = self.validated_data['cartitem_set']
+
+            # 庫存不足時丟出 InsufficientInventory，整筆交易復原
+            reserve_inventory(
+                {i.product_id: i.quantity for i in cartitem_set})
+
+            order = Order(
                 customer_id=self.context['customer_id'],
                 shipping_address_id=shipping_address_id
             )
+            order.set_totals(sum(i.quantity * i.price for i in cartitem_set))
+            order.save()
 
             orderitem_set = [OrderItem(
                 order=order,
-                product=i.product,
+                product_id=i.product_id,
                 quantity=i.quantity,
                 price=i.price
             ) for i in cartitem_set]
 
             OrderItem.objects.bulk_create(orderitem_set)
 
-            Cart.objects.filter(pk=cart_id).delete()
+            cart_store = get_cart_store()
+            if cart_store is not None:
+                # 訂單確定寫入後才清掉 Redis 購物車
+                transaction.on_commit(lambda: cart_store.delete(cart_id))
+            else:
+                Cart.objects.filter(pk=cart_id).delete()
 
             return order
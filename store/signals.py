@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .caching import bump_version_on_commit
+from .models import Collection, Product, ProductImage, Review
+from .search import index_products, unindex_products
+from .images import schedule_derivatives
+from pyshop.storage import delete_file_on_commit
+
+# 注意：queryset.update() / bulk_create() 不會觸發 signal，需要自行 bump_version
+# 版本號都在 commit 後才 bump（見 bump_version_on_commit）
+
+
+def touch_product(product_id):
+    # 圖片、評論屬於產品的一部分，更新 update_date 讓 ETag / Last-Modified 跟著變
+    Product.objects.filter(pk=product_id).update(update_date=timezone.now())
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_collection(sender, instance, **kwargs):
+    bump_version_on_commit('collection', instance.pk)
+
+
+@receiver(post_save, sender=Collection)
+def reindex_collection_products(sender, instance, **kwargs):
+    # 索引裡存有 collection 標題
+    product_ids = list(instance.product_set.values_list('id', flat=True))
+    if product_ids:
+        transaction.on_commit(lambda: index_products(product_ids))
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_collection(sender, instance, **kwargs):
+    # 產品換 collection 時，舊 collection 的 products_count 也要失效
+    if instance.pk is None:
+        return
+    instance._old_collection_id = Product.objects.filter(
+        pk=instance.pk).values_list('collection_id', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    bump_version_on_commit('product', instance.pk)
+    bump_version_on_commit('collection', instance.collection_id)
+    old_collection_id = getattr(instance, '_old_collection_id', None)
+    if old_collection_id != instance.collection_id:
+        bump_version_on_commit('collection', old_collection_id)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    # commit 後才送去索引，交易失敗或 ES 變慢都不會卡住寫入
+    transaction.on_commit(lambda: index_products([instance.pk]))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: unindex_products([product_id]))
+
+
+@receiver(post_save, sender=ProductImage)
+def generate_image_derivatives(sender, instance, created, **kwargs):
+    # 只在新上傳時產生；產生完存回時 created=False，不會重複觸發
+    if created:
+        image_id = instance.pk
+        transaction.on_commit(lambda: schedule_derivatives(image_id))
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_files(sender, instance, **kwargs):
+    # 只移除檔名，blob 沒有其他人用時由 gc_media_blobs 回收
+    delete_file_on_commit(ProductImage, 'image', instance.image.name)
+    for variant in instance.variants:
+        delete_file_on_commit(ProductImage, 'image', variant['path'])
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def invalidate_product_image(sender, instance, **kwargs):
+    touch_product(instance.product_id)
+    bump_version_on_commit('product', instance.product_id)
+    # ?expand=products 的 collection 回應也帶有圖片
+    collection_id = Product.objects.filter(
+        pk=instance.product_id).values_list('collection_id', flat=True).first()
+    bump_version_on_commit('collection', collection_id)
+
+
+def rating_delta(rating, sign):
+    return {'ratings': sign * (rating is not None), 'rating_sum': sign * (rating or 0)}
+
+
+@receiver(pre_save, sender=Review)
+def remember_old_rating(sender, instance, **kwargs):
+    # 修改評分時要先扣掉舊的分數
+    if instance.pk is None:
+        return
+    instance._old_rating = Review.objects.filter(
+        pk=instance.pk).values_list('rating', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def add_review_stats(sender, instance, created, **kwargs):
+    # ReviewViewSet 的寫入包在交易裡，統計跟評論一起 commit
+    if created:
+        delta = {'reviews': 1, **rating_delta(instance.rating, 1)}
+    else:
+        old = rating_delta(getattr(instance, '_old_rating', None), -1)
+        new = rating_delta(instance.rating, 1)
+        delta = {key: old[key] + new[key] for key in new}
+    if any(delta.values()):
+        Product.objects.filter(pk=instance.product_id).add_review_stats(**delta)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_stats(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).add_review_stats(
+        reviews=-1, **rating_delta(instance.rating, -1))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review(sender, instance, **kwargs):
+    touch_product(instance.product_id)
+    bump_version_on_commit('product', instance.product_id)
+    bump_version_on_commit('reviews', instance.product_id)
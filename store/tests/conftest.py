@@ -0,0 +1,17 @@
+import pytest
+from django.core.cache import cache
+
+# 測試用的 Redis DB，不會清到開發環境 DB 0 的快取與購物車
+TEST_REDIS_DB = 15
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(settings):
+    default = settings.CACHES['default']
+    if default['BACKEND'] == 'django_redis.cache.RedisCache':
+        location = default['LOCATION'].rsplit('/', 1)[0]
+        settings.CACHES = {**settings.CACHES, 'default': {
+            **default, 'LOCATION': f'{location}/{TEST_REDIS_DB}'}}
+    # 測試之間 pk 會重複使用，上一個測試的回應快取 / 版本號不能留著
+    cache.clear()
+    yield
@@ -0,0 +1,309 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from model_bakery import baker
+from store.carts import RedisCartStore
+from store.views import RedisCartItemViewSet, RedisCartViewSet
+from store.models import Address, Cart, CartItem, Customer, Order, OrderItem, Product
+
+
+@pytest.mark.django_db
+class TestRetrieveCart:
+    def test_total_price_computed_in_database(self, django_assert_num_queries):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        for price, quantity in [(10, 2), (5, 3)]:
+            baker.make(CartItem, cart=cart, quantity=quantity, price=price,
+                       product=baker.make(Product, price=price))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        # 購物車 + 總額一次，品項 + 產品一次
+        with django_assert_num_queries(2):
+            response = client.get(f'/store/carts/{cart.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_price'] == 35
+        assert sorted(i['total_price'] for i in response.data['cartitem_set']) == [15, 20]
+
+    def test_summary_does_not_load_items(self, django_assert_num_queries):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        baker.make(CartItem, cart=cart, quantity=2, price=10,
+                   product=baker.make(Product, price=10))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with django_assert_num_queries(1):
+            response = client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert response.data == {
+            'id': str(cart.id), 'item_count': 2, 'total_price': 20}
+
+    def test_empty_cart_total_is_zero(self):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.get(f'/store/carts/{cart.id}/summary/')
+
+        assert response.data['total_price'] == 0
+
+
+@pytest.mark.django_db
+class TestAddCartItem:
+    def test_add_existing_product_increments_quantity(self):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        product = baker.make(Product, price=10)
+        client = APIClient()
+        client.force_authenticate(user=user)
+        url = f'/store/carts/{cart.id}/cartitem_set/'
+
+        client.post(url, {'product': product.id, 'quantity': 2})
+        response = client.post(url, {'product': product.id, 'quantity': 3})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['quantity'] == 5
+        assert CartItem.objects.filter(cart=cart).count() == 1
+
+    def test_patch_quantity_returns_new_total(self):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        item = baker.make(CartItem, cart=cart, quantity=1, price=10,
+                          product=baker.make(Product, price=10))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.patch(f'/store/carts/{cart.id}/cartitem_set/{item.id}/',
+                                {'quantity': 5})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_price'] == 50
+
+
+@pytest.mark.django_db
+class TestBulkAddCartItem:
+    def test_bulk_add_merges_into_existing_items(self, django_assert_max_num_queries):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        a, b = baker.make(Product, price=10, _quantity=2)
+        baker.make(CartItem, cart=cart, product=a, quantity=1, price=10)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with django_assert_max_num_queries(6):
+            response = client.post(f'/store/carts/{cart.id}/cartitem_set/bulk/', {
+                'items': [{'product': a.id, 'quantity': 2},
+                          {'product': b.id, 'quantity': 1},
+                          {'product': b.id, 'quantity': 1}]
+            }, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        quantities = dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity'))
+        assert quantities == {a.id: 3, b.id: 2}
+
+    def test_unknown_product_adds_nothing(self):
+        user = baker.make(Customer)
+        cart = baker.make(Cart, user=user)
+        product = baker.make(Product)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post(f'/store/carts/{cart.id}/cartitem_set/bulk/', {
+            'items': [{'product': product.id, 'quantity': 1},
+                      {'product': product.id + 100, 'quantity': 1}]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not CartItem.objects.filter(cart=cart).exists()
+
+    def test_other_users_cart_return_403(self):
+        cart = baker.make(Cart, user=baker.make(Customer))
+        product = baker.make(Product)
+        client = APIClient()
+        client.force_authenticate(user=baker.make(Customer))
+
+        response = client.post(f'/store/carts/{cart.id}/cartitem_set/bulk/', {
+            'items': [{'product': product.id, 'quantity': 1}]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentQuantityUpsert:
+    def run_parallel(self, func, times):
+        def worker(_):
+            try:
+                func()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(worker, range(times)))
+
+    def test_parallel_cart_adds_lose_no_updates(self):
+        cart = baker.make(Cart)
+        product = baker.make(Product, price=10)
+
+        self.run_parallel(
+            lambda: CartItem.objects.add_quantity(cart.id, product, 1), 20)
+
+        assert CartItem.objects.get(cart=cart, product=product).quantity == 20
+
+    def test_parallel_order_adds_lose_no_updates(self):
+        order = baker.make(Order)
+        product = baker.make(Product, price=10)
+
+        self.run_parallel(
+            lambda: OrderItem.objects.add_quantity(order.id, product, 2), 20)
+
+        assert OrderItem.objects.get(order=order, product=product).quantity == 40
+
+
+@pytest.fixture
+def cart_store():
+    store = RedisCartStore()
+    yield store
+    for key in store.client.scan_iter('store:cart:*'):
+        store.client.delete(key)
+
+
+@pytest.mark.django_db
+class TestRedisCartStore:
+    def test_add_increments_quantity_atomically(self, cart_store):
+        cart_id, created = cart_store.create(1)
+
+        cart_store.add(cart_id, 5, 2, 100)
+        quantity = cart_store.add(cart_id, 5, 3, 999)
+
+        item, = cart_store.items(cart_id)
+        assert created
+        assert quantity == 5
+        # 價格以第一次加入時為準
+        assert (item.product_id, item.quantity, item.price) == (5, 5, 100)
+
+    def test_add_many_returns_new_quantities(self, cart_store):
+        cart_id, _ = cart_store.create(1)
+        cart_store.add(cart_id, 5, 1, 100)
+
+        assert cart_store.add_many(cart_id, [(5, 2, 100), (6, 1, 50)]) == [3, 1]
+
+    def test_create_reuses_existing_cart(self, cart_store):
+        cart_id, _ = cart_store.create(1)
+
+        assert cart_store.create(1) == (cart_id, False)
+
+    def test_concurrent_create_makes_one_cart(self, cart_store):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: RedisCartStore().create(1), range(8)))
+
+        assert len({cart_id for cart_id, _ in results}) == 1
+        assert [created for _, created in results].count(True) == 1
+        assert len(list(cart_store.client.scan_iter('store:cart:*:meta'))) == 1
+
+    def test_remove_refreshes_ttl(self, cart_store):
+        cart_id, _ = cart_store.create(1)
+        cart_store.add(cart_id, 5, 1, 100)
+        cart_store.add(cart_id, 6, 1, 100)
+        cart_store.client.expire(cart_store.items_key(cart_id), 10)
+
+        cart_store.remove(cart_id, 5)
+
+        assert cart_store.client.ttl(cart_store.items_key(cart_id)) > 10
+
+    def test_carts_expire(self, cart_store):
+        cart_id, _ = cart_store.create(1)
+        cart_store.add(cart_id, 5, 1, 100)
+
+        assert 0 < cart_store.client.ttl(cart_store.items_key(cart_id)) <= cart_store.timeout
+
+    def test_checkout_materializes_redis_cart(self, cart_store, settings):
+        settings.CART_BACKEND = 'redis'
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=5, price=10)
+        cart_id, _ = cart_store.create(user.id)
+        cart_store.add(cart_id, product.id, 2, product.price)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with TestCase.captureOnCommitCallbacks(execute=True):
+            response = client.post('/store/orders/', {
+                'cart_id': cart_id, 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['orderitem_set'][0]['quantity'] == 2
+        assert cart_store.items(cart_id) == []
+
+    def test_checkout_of_other_users_redis_cart_return_400(self, cart_store, settings):
+        settings.CART_BACKEND = 'redis'
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=5, price=10)
+        cart_id, _ = cart_store.create(baker.make(Customer).id)
+        cart_store.add(cart_id, product.id, 2, product.price)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': cart_id, 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert len(cart_store.items(cart_id)) == 1
+
+
+@pytest.mark.django_db
+class TestAnonymousRedisCart:
+    create_cart = staticmethod(RedisCartViewSet.as_view({'post': 'create'}))
+    add_item = staticmethod(RedisCartItemViewSet.as_view({'post': 'create'}))
+
+    def request(self, view, data, user=None, token=None, **kwargs):
+        headers = {'HTTP_X_CART_TOKEN': token} if token else {}
+        request = APIRequestFactory().post('/', data, format='json', **headers)
+        if user is not None:
+            force_authenticate(request, user=user)
+        return view(request, **kwargs)
+
+    def test_anonymous_cart_needs_token(self, cart_store, settings):
+        settings.CART_BACKEND = 'redis'
+        product = baker.make(Product, price=10)
+        cart = self.request(self.create_cart, {}).data
+
+        without_token = self.request(self.add_item, {'product': product.id, 'quantity': 1},
+                                     cart_pk=cart['id'])
+        with_token = self.request(self.add_item, {'product': product.id, 'quantity': 1},
+                                  token=cart['token'], cart_pk=cart['id'])
+
+        assert cart['token']
+        assert without_token.status_code == status.HTTP_403_FORBIDDEN
+        assert with_token.status_code == status.HTTP_201_CREATED
+
+    def test_login_claims_anonymous_cart(self, cart_store, settings):
+        settings.CART_BACKEND = 'redis'
+        user = baker.make(Customer)
+        cart_id, token = cart_store.create_anonymous()
+        cart_store.add(cart_id, 5, 2, 100)
+        user_cart_id, _ = cart_store.create(user.id)
+        cart_store.add(user_cart_id, 5, 1, 100)
+
+        response = self.request(self.create_cart, {'cart_id': cart_id}, user=user, token=token)
+
+        assert response.data['id'] == user_cart_id
+        item, = cart_store.items(user_cart_id)
+        assert item.quantity == 3
+        assert not cart_store.check_token(cart_id, token)
+
+    def test_claim_with_wrong_token_return_403(self, cart_store, settings):
+        settings.CART_BACKEND = 'redis'
+        cart_id, _ = cart_store.create_anonymous()
+
+        response = self.request(self.create_cart, {'cart_id': cart_id},
+                                user=baker.make(Customer), token='guess')
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
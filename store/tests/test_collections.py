@@ -3,7 +3,8 @@ from rest_framework import status
 from rest_framework.test import APIClient
 from model_bakery import baker
 from django.contrib.auth.models import User
-from store.models import Collection
+from store.models import Collection, Product
+from store.views import CollectionViewSet
 
 
 @pytest.mark.django_db
@@ -54,3 +55,44 @@ class TestGetCollection:
                     'title' : collection.title,
                 }
 
+
+
+@pytest.mark.django_db
+class TestListCollection:
+    def test_default_list_is_one_aggregate_query(self, django_assert_num_queries):
+        client = APIClient()
+        collections = baker.make(Collection, _quantity=3)
+        baker.make(Product, collection=collections[0], _quantity=2)
+
+        # 只有列表本身（ETag 用這一頁的資料列與快取版本號）
+        with django_assert_num_queries(1):
+            response = client.get('/store/collections/')
+
+        assert response.status_code == status.HTTP_200_OK
+        counts = {c['id']: c['products_count'] for c in response.data['results']}
+        assert counts[collections[0].id] == 2
+        assert 'products' not in response.data['results'][0]
+
+    def test_expand_products_limits_nested_products(self, monkeypatch):
+        client = APIClient()
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+        monkeypatch.setattr(CollectionViewSet, 'expand_products_limit', 2)
+
+        response = client.get('/store/collections/', {'expand': 'products'})
+
+        result = response.data['results'][0]
+        assert result['products_count'] == 3
+        assert len(result['products']) == 2
+        assert result['products_url'].endswith(
+            f'/store/collections/{collection.id}/products/')
+
+    def test_collection_products_return_only_its_products(self):
+        client = APIClient()
+        collection, other = baker.make(Collection, _quantity=2)
+        product = baker.make(Product, collection=collection)
+        baker.make(Product, collection=other)
+
+        response = client.get(f'/store/collections/{collection.id}/products/')
+
+        assert [p['id'] for p in response.data['results']] == [product.id]
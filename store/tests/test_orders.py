@@ -0,0 +1,183 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+from model_bakery import baker
+from store.inventory import InsufficientInventory, reserve_inventory
+from store.models import Address, Cart, CartItem, Customer, Order, OrderItem, Product
+
+
+def make_cart(user, *lines):
+    cart = baker.make(Cart, user=user)
+    for product, quantity in lines:
+        baker.make(CartItem, cart=cart, product=product,
+                   quantity=quantity, price=product.price)
+    return cart
+
+
+@pytest.mark.django_db
+class TestReserveInventory:
+    def test_enough_inventory_decrements_all_lines(self):
+        a = baker.make(Product, inventory=5)
+        b = baker.make(Product, inventory=3)
+
+        reserve_inventory({a.id: 2, b.id: 3})
+
+        a.refresh_from_db()
+        b.refresh_from_db()
+        assert (a.inventory, b.inventory) == (3, 0)
+
+    def test_one_short_line_rolls_back_every_line(self):
+        a = baker.make(Product, inventory=5)
+        b = baker.make(Product, inventory=1)
+
+        with pytest.raises(InsufficientInventory) as e:
+            reserve_inventory({a.id: 2, b.id: 3})
+
+        a.refresh_from_db()
+        assert a.inventory == 5
+        assert e.value.shortfalls == [
+            {'product': b.id, 'requested': 3, 'available': 1}]
+
+
+@pytest.mark.django_db
+class TestCreateOrder:
+    def test_checkout_decrements_inventory(self):
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=5)
+        cart = make_cart(user, (product, 2))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.id), 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        product.refresh_from_db()
+        assert product.inventory == 3
+
+    def test_checkout_stores_totals_from_cart_price(self):
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=5, price=100)
+        cart = make_cart(user, (product, 2))
+        Product.objects.filter(pk=product.pk).update(price=999)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.id), 'shipping_address_id': address.id})
+
+        order = Order.objects.get(pk=response.data['id'])
+        assert (order.subtotal, order.total) == (200, 220)
+        assert response.data['total_price'] == 200
+
+    def test_insufficient_inventory_return_409(self):
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=1)
+        cart = make_cart(user, (product, 2))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.id), 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['inventory'][0]['available'] == 1
+        assert not Order.objects.exists()
+        assert Cart.objects.filter(pk=cart.id).exists()
+
+    def test_address_of_other_customer_return_400(self):
+        user = baker.make(Customer)
+        address = baker.make(Address)
+        product = baker.make(Product, inventory=5)
+        cart = make_cart(user, (product, 1))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.id), 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['shipping_address_id'] is not None
+
+    def test_cart_of_other_customer_return_400(self):
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        product = baker.make(Product, inventory=5)
+        cart = make_cart(baker.make(Customer), (product, 1))
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        response = client.post('/store/orders/', {
+            'cart_id': str(cart.id), 'shipping_address_id': address.id})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['cart_id'] is not None
+        product.refresh_from_db()
+        assert product.inventory == 5
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        user = baker.make(Customer)
+        address = baker.make(Address, customer=user)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        def checkout(size):
+            products = baker.make(Product, inventory=10, _quantity=size)
+            cart = make_cart(user, *[(p, 1) for p in products])
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post('/store/orders/', {
+                    'cart_id': str(cart.id), 'shipping_address_id': address.id})
+            assert response.status_code == status.HTTP_201_CREATED
+            assert len(response.data['orderitem_set']) == size
+            return len(queries)
+
+        small = checkout(1)
+        large = checkout(10)
+
+        assert small == large
+        assert large <= 20
+
+
+@pytest.mark.django_db
+class TestListOrder:
+    def test_list_is_single_table_read(self, django_assert_num_queries):
+        user = baker.make(Customer)
+        baker.make(Order, customer=user, subtotal=100, total=110, _quantity=3)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with django_assert_num_queries(1):
+            response = client.get('/store/orders/')
+
+        assert [o['total'] for o in response.data] == [110] * 3
+
+
+@pytest.mark.django_db
+class TestBackfillOrderTotals:
+    def test_backfill_uses_captured_item_price(self):
+        orders = baker.make(Order, _quantity=3)
+        baker.make(OrderItem, order=orders[0], quantity=2, price=50)
+        baker.make(OrderItem, order=orders[0], quantity=1, price=10)
+
+        call_command('backfill_order_totals', chunk_size=2)
+
+        orders[0].refresh_from_db()
+        orders[2].refresh_from_db()
+        assert (orders[0].subtotal, orders[0].total) == (110, 121)
+        assert orders[2].subtotal == 0
+
+
+class TestOrderTotals:
+    def test_total_rounds_half_up(self):
+        order = Order()
+
+        order.set_totals(15)
+
+        # 15 * 1.1 = 16.5，round() 會得到 16
+        assert (order.subtotal, order.total) == (15, 17)
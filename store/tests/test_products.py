@@ -0,0 +1,849 @@
+import base64
+import io
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+import pytest
+from django.apps import apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from model_bakery import baker
+from PIL import Image as PILImage
+from pyshop.uploads import ChunkedUpload
+from store.caching import get_version
+from store.catalog import ProductImporter
+from store.inventory import reserve_inventory
+from store.models import Collection, Customer, Product, ProductImage, Review
+
+
+@pytest.mark.django_db
+class TestListProduct:
+    def test_first_page_return_200(self):
+        client = APIClient()
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=3)
+
+        response = client.get('/store/products/', {'page_size': 2})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 2
+        assert response.data['next'] is not None
+        assert response.data['previous'] is None
+
+    def test_cursor_walks_all_products_once(self):
+        client = APIClient()
+        collection = baker.make(Collection)
+        # 相同 title 也要靠 id 排出穩定順序
+        products = baker.make(Product, collection=collection,
+                              title='same', _quantity=5)
+
+        seen = []
+        url, params = '/store/products/', {'page_size': 2}
+        while url:
+            response = client.get(url, params)
+            seen += [p['id'] for p in response.data['results']]
+            url, params = response.data['next'], None
+
+        assert seen == sorted(p.id for p in products)
+
+    def test_previous_link_return_previous_page(self):
+        client = APIClient()
+        collection = baker.make(Collection)
+        baker.make(Product, collection=collection, _quantity=4)
+
+        first = client.get('/store/products/', {'page_size': 2})
+        second = client.get(first.data['next'])
+        back = client.get(second.data['previous'])
+
+        assert back.data['results'] == first.data['results']
+
+    def test_cursor_invalid_return_404(self):
+        client = APIClient()
+
+        response = client.get('/store/products/', {'cursor': 'not-a-cursor'})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_cursor_with_wrong_types_return_404(self):
+        client = APIClient()
+        payload = json.dumps({'p': ['a', 'x'], 'r': 0, 'o': ['title', 'id']})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+
+        response = client.get('/store/products/', {'cursor': cursor})
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestRetrieveProductCache:
+    def test_version_bumped_only_after_commit(self, django_capture_on_commit_callbacks):
+        product = baker.make(Product)
+        version = get_version('product', product.pk)
+
+        with django_capture_on_commit_callbacks() as callbacks:
+            product.save()
+            assert get_version('product', product.pk) == version
+        for callback in callbacks:
+            callback()
+
+        assert get_version('product', product.pk) != version
+
+    def test_second_request_served_from_cache(self, django_assert_num_queries):
+        client = APIClient()
+        product = baker.make(Product)
+        client.get(f'/store/products/{product.id}/')
+
+        # ETag 用快取的版本號，整個請求不查資料庫
+        with django_assert_num_queries(0):
+            response = client.get(f'/store/products/{product.id}/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['id'] == product.id
+
+    def test_product_save_invalidates_cache(self, django_capture_on_commit_callbacks):
+        client = APIClient()
+        product = baker.make(Product, price=10)
+        client.get(f'/store/products/{product.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.price = 20
+            product.save()
+        response = client.get(f'/store/products/{product.id}/')
+
+        assert response.data['price'] == 20
+
+    def test_image_save_invalidates_cache(self, django_capture_on_commit_callbacks):
+        client = APIClient()
+        product = baker.make(Product)
+        client.get(f'/store/products/{product.id}/')
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(ProductImage, product=product, image='product/a.jpg')
+        response = client.get(f'/store/products/{product.id}/')
+
+        assert len(response.data['productimage_set']) == 1
+
+
+@pytest.mark.django_db
+class TestConditionalGetProduct:
+    def test_matching_etag_return_304(self):
+        client = APIClient()
+        product = baker.make(Product)
+        etag = client.get(f'/store/products/{product.id}/')['ETag']
+
+        response = client.get(f'/store/products/{product.id}/',
+                              HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_product_update_changes_detail_etag(self, django_capture_on_commit_callbacks):
+        client = APIClient()
+        product = baker.make(Product, price=10)
+        etag = client.get(f'/store/products/{product.id}/')['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.price = 20
+            product.save()
+        response = client.get(f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['price'] == 20
+
+    def test_detail_etag_falls_back_to_aggregate(self, settings):
+        settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        client = APIClient()
+        product = baker.make(Product)
+        etag = client.get(f'/store/products/{product.id}/')['ETag']
+
+        response = client.get(f'/store/products/{product.id}/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_product_update_changes_etag(self):
+        client = APIClient()
+        product = baker.make(Product)
+        etag = client.get('/store/products/')['ETag']
+
+        product.save()
+        response = client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_list_etag_without_aggregate(self, django_assert_num_queries):
+        client = APIClient()
+        baker.make(Product, _quantity=3)
+        first = client.get('/store/products/', {'page_size': 2})
+
+        # 下一頁也只有產品與圖片 prefetch 兩個查詢
+        with django_assert_num_queries(2):
+            response = client.get(first.data['next'])
+        assert response.status_code == status.HTTP_200_OK
+
+        response = client.get(first.data['next'], HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_inventory_change_changes_list_etag(self):
+        client = APIClient()
+        product = baker.make(Product, inventory=5)
+        etag = client.get('/store/products/')['ETag']
+
+        reserve_inventory({product.id: 1})
+        response = client.get('/store/products/', HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['inventory'] == 4
+
+    def test_new_review_changes_reviews_etag(self, django_capture_on_commit_callbacks):
+        client = APIClient()
+        product = baker.make(Product)
+        url = f'/store/products/{product.id}/reviews/'
+        etag = client.get(url)['ETag']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            baker.make(Review, product=product)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 1
+
+
+@pytest.mark.django_db
+class TestImportExportProducts:
+    def test_import_creates_and_updates_by_sku(self, tmp_path):
+        collection = baker.make(Collection, title='Fish')
+        product = baker.make(Product, sku='A-1', price=10, collection=collection)
+        feed = tmp_path / 'products.csv'
+        feed.write_text(
+            'sku,title,description,price,inventory,collection\n'
+            'A-1,,,25,,\n'
+            'B-2,New,Desc,30,4,Fish\n'
+            'C-3,Bad,Desc,30,4,Missing\n', encoding='utf-8')
+
+        call_command('import_products', str(feed), chunk_size=2)
+
+        product.refresh_from_db()
+        assert product.price == 25
+        assert Product.objects.get(sku='B-2').collection == collection
+        assert not Product.objects.filter(sku='C-3').exists()
+
+    def test_import_rejects_values_over_field_limits(self):
+        baker.make(Collection, title='Fish')
+        rows = [
+            {'sku': 'S' * 65, 'title': 't', 'description': 'd', 'price': 1,
+             'inventory': 1, 'collection': 'Fish'},
+            {'sku': 'T-1', 'title': 't' * 256, 'description': 'd', 'price': 1,
+             'inventory': 1, 'collection': 'Fish'},
+            {'sku': 'N-1', 'title': 't', 'description': 'd', 'price': 1,
+             'inventory': -1, 'collection': 'Fish'},
+        ]
+
+        result = ProductImporter().run(enumerate(rows, start=1))
+
+        assert result['created'] == 0
+        assert result['errors'] == [
+            {'line': 1, 'error': 'sku 太長'},
+            {'line': 2, 'error': 'title 太長'},
+            {'line': 3, 'error': 'inventory 不能是負數'},
+        ]
+
+    def test_import_reports_database_errors_per_chunk(self, monkeypatch):
+        baker.make(Collection, title='Fish')
+        row = {'title': 't', 'description': 'd', 'price': 1, 'inventory': 1, 'collection': 'Fish'}
+        rows = [{'sku': f'A-{i}', **row} for i in range(4)]
+        bulk_create = Product.objects.bulk_create
+
+        def fail_on_first_chunk(objs, *args, **kwargs):
+            if any(p.sku == 'A-0' for p in objs):
+                raise IntegrityError('duplicate')
+            return bulk_create(objs, *args, **kwargs)
+
+        monkeypatch.setattr(Product.objects, 'bulk_create', fail_on_first_chunk)
+
+        result = ProductImporter(chunk_size=2).run(enumerate(rows, start=1))
+
+        assert result['created'] == 2
+        assert result['errors'] == [{'line': 1, 'error': '第 1-2 行未匯入: duplicate'}]
+        assert set(Product.objects.values_list('sku', flat=True)) == {'A-2', 'A-3'}
+
+    def test_import_moving_collection_invalidates_both(self):
+        old = baker.make(Collection, title='Old')
+        new = baker.make(Collection, title='New')
+        baker.make(Product, sku='A-1', collection=old)
+        old_version = get_version('collection', old.pk)
+        new_version = get_version('collection', new.pk)
+
+        ProductImporter().run([(1, {'sku': 'A-1', 'collection': 'New'})])
+
+        assert get_version('collection', old.pk) != old_version
+        assert get_version('collection', new.pk) != new_version
+
+    def test_import_endpoint_reads_ndjson(self):
+        collection = baker.make(Collection, title='Fish')
+        client = APIClient()
+        client.force_authenticate(user=baker.make(Customer, is_staff=True))
+        feed = SimpleUploadedFile('products.ndjson', (
+            '{"sku": "N-1", "title": "t", "description": "d", "price": 1, '
+            '"inventory": 2, "collection": "Fish"}\n'
+            'not json\n').encode())
+
+        response = client.post('/store/products/import/', {'file': feed})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['created'] == 1
+        assert response.data['errors'] == [{'line': 2, 'error': '格式錯誤'}]
+        assert Product.objects.get(sku='N-1').collection == collection
+
+    def test_import_malformed_ndjson_lines_are_line_errors(self):
+        baker.make(Collection, title='Fish')
+        client = APIClient()
+        client.force_authenticate(user=baker.make(Customer, is_staff=True))
+        feed = SimpleUploadedFile('products.ndjson', (
+            '{"sku": "N-1", "title": "t", "description": "d", "price": 1, '
+            '"inventory": 2, "collection": ["Fish"]}\n'
+            + '[' * 100000 + ']' * 100000 + '\n').encode())
+
+        response = client.post('/store/products/import/', {'file': feed})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['errors'] == [
+            {'line': 1, 'error': "找不到 collection: ['Fish']"},
+            {'line': 2, 'error': '格式錯誤'},
+        ]
+
+    def test_import_invalid_utf8_return_400(self):
+        client = APIClient()
+        client.force_authenticate(user=baker.make(Customer, is_staff=True))
+        feed = SimpleUploadedFile('products.csv', b'sku,title\nA-1,\xff\xfe\n')
+
+        response = client.post('/store/products/import/', {'file': feed})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Product.objects.exists()
+
+    def test_export_streams_csv(self):
+        product = baker.make(Product, sku='A-1', price=10)
+        client = APIClient()
+        client.force_authenticate(user=baker.make(Customer, is_staff=True))
+
+        response = client.get('/store/products/export/', {'file_format': 'csv'})
+
+        body = b''.join(response.streaming_content).decode()
+        assert response.status_code == status.HTTP_200_OK
+        assert body.splitlines()[0] == 'sku,title,description,price,inventory,collection'
+        assert body.splitlines()[1].startswith(f'A-1,{product.title},')
+
+    def test_export_requires_admin(self):
+        client = APIClient()
+
+        response = client.get('/store/products/export/')
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.django_db
+class TestFilterProduct:
+    def test_filter_by_collection_and_price(self):
+        collection = baker.make(Collection)
+        product = baker.make(Product, collection=collection, price=50, inventory=1)
+        baker.make(Product, collection=collection, price=500, inventory=1)
+        baker.make(Product, collection=collection, price=50, inventory=0)
+        baker.make(Product, price=50, inventory=1)
+        client = APIClient()
+
+        response = client.get('/store/products/', {
+            'collection_id': collection.id, 'price__lte': 100, 'inventory__gt': 0})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [p['id'] for p in response.data['results']] == [product.id]
+
+    def test_invalid_filter_return_400(self):
+        client = APIClient()
+
+        response = client.get('/store/products/', {'price__gte': 'cheap'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_ordering_by_price_walks_all_products_once(self):
+        baker.make(Product, price=iter([30, 10, 20, 10, 30]), _quantity=5)
+        client = APIClient()
+
+        url = '/store/products/?ordering=-price&page_size=2'
+        prices = []
+        while url:
+            response = client.get(url)
+            prices += [p['price'] for p in response.data['results']]
+            url = response.data['next']
+
+        assert prices == [30, 30, 20, 10, 10]
+
+    def test_ordering_by_update_date_keeps_microseconds(self):
+        products = baker.make(Product, _quantity=5)
+        base = timezone.now().replace(microsecond=0)
+        # 全部落在同一毫秒內
+        for i, product in enumerate(products):
+            Product.objects.filter(pk=product.pk).update(
+                update_date=base + timedelta(microseconds=100 * i + 1))
+        client = APIClient()
+
+        url = '/store/products/?ordering=update_date&page_size=1'
+        seen = []
+        # 重複回傳時不會走完，限制頁數
+        while url and len(seen) <= len(products):
+            response = client.get(url)
+            seen += [p['id'] for p in response.data['results']]
+            url = response.data['next']
+
+        assert seen == [p.id for p in products]
+
+    def test_cursor_from_other_ordering_return_404(self):
+        baker.make(Product, _quantity=3)
+        client = APIClient()
+        next_url = client.get('/store/products/?page_size=1').data['next']
+
+        response = client.get(next_url + '&ordering=price')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+class TestBenchmarkProductList:
+    def test_seeds_and_reports_every_query(self):
+        out = io.StringIO()
+
+        call_command('benchmark_product_list', products=30, collections=2,
+                     repeat=2, seed=True, keep=True, interactive=False, stdout=out)
+
+        assert Product.objects.count() == 30
+        assert 'ordering=price' in out.getvalue()
+
+    def test_seeded_rows_deleted_afterwards(self):
+        product = baker.make(Product)
+
+        call_command('benchmark_product_list', products=30, collections=2, repeat=1,
+                     seed=True, interactive=False, chunk_size=7, stdout=io.StringIO())
+
+        assert list(Product.objects.all()) == [product]
+        assert not Collection.objects.filter(title__startswith='bench-').exists()
+
+    def test_without_seed_writes_nothing(self):
+        call_command('benchmark_product_list', products=30, repeat=1, stdout=io.StringIO())
+
+        assert not Product.objects.exists()
+
+
+@pytest.mark.django_db
+class TestReviewStats:
+    def test_create_and_delete_review_updates_product(self):
+        product = baker.make(Product)
+        client = APIClient()
+        url = f'/store/products/{product.id}/reviews/'
+
+        client.post(url, {'name': 'a', 'description': 'a', 'rating': 5})
+        response = client.post(url, {'name': 'b', 'description': 'b', 'rating': 2})
+        client.post(url, {'name': 'c', 'description': 'no rating'})
+        product.refresh_from_db()
+
+        assert product.review_count == 3
+        assert product.rating_avg == Decimal('3.50')
+
+        client.delete(f'{url}{response.data["id"]}/')
+        product.refresh_from_db()
+
+        assert product.review_count == 2
+        assert product.rating_avg == Decimal('5.00')
+
+    def test_edit_rating_updates_average(self):
+        product = baker.make(Product)
+        client = APIClient()
+        url = f'/store/products/{product.id}/reviews/'
+        client.post(url, {'name': 'a', 'description': 'a', 'rating': 5})
+        response = client.post(url, {'name': 'b', 'description': 'b'})
+
+        client.patch(f'{url}{response.data["id"]}/', {'rating': 2})
+        product.refresh_from_db()
+
+        assert (product.review_count, product.rating_count, product.rating_sum) == (2, 2, 7)
+        assert product.rating_avg == Decimal('3.50')
+
+    def test_review_write_does_not_recount(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=4, _quantity=3)
+
+        with CaptureQueriesContext(connection) as queries:
+            baker.make(Review, product=product, rating=2)
+        product.refresh_from_db()
+
+        assert not any('AVG(' in q['sql'] or 'COUNT(' in q['sql'] for q in queries)
+        assert product.review_count == 4
+        assert product.rating_avg == Decimal('3.50')
+
+    def test_invalid_rating_return_400(self):
+        product = baker.make(Product)
+        client = APIClient()
+
+        response = client.post(f'/store/products/{product.id}/reviews/',
+                               {'name': 'a', 'description': 'a', 'rating': 6})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_list_exposes_stats_without_extra_queries(self, django_assert_num_queries):
+        baker.make(Review, product__review_count=0, rating=4, _quantity=3)
+        client = APIClient()
+
+        # 產品、圖片 prefetch（ETag 用這一頁的資料列與快取版本號，不另外查）
+        with django_assert_num_queries(2):
+            response = client.get('/store/products/')
+
+        assert [p['review_count'] for p in response.data['results']] == [1, 1, 1]
+        assert response.data['results'][0]['rating_avg'] == '4.00'
+
+    def test_migration_backfills_existing_reviews(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=4, _quantity=2)
+        Product.objects.update(review_count=0, rating_count=0, rating_sum=0, rating_avg=None)
+        migration = importlib.import_module('store.migrations.0030_backfill_review_stats')
+
+        migration.backfill_review_stats(apps, None)
+        # 補完之後刪掉遷移前就有的評論不會減到負數
+        Review.objects.filter(product=product).first().delete()
+        product.refresh_from_db()
+
+        assert (product.review_count, product.rating_count, product.rating_sum) == (1, 1, 4)
+        assert product.rating_avg == Decimal('4.00')
+
+    def test_recompute_command_fixes_drift(self):
+        product = baker.make(Product)
+        baker.make(Review, product=product, rating=3, _quantity=2)
+        Product.objects.update(review_count=0, rating_count=0, rating_sum=0, rating_avg=None)
+
+        call_command('recompute_review_stats', stdout=io.StringIO())
+        product.refresh_from_db()
+
+        assert (product.review_count, product.rating_count, product.rating_sum) == (2, 2, 6)
+        assert product.rating_avg == Decimal('3.00')
+
+
+@pytest.mark.django_db
+class TestListReview:
+    def test_cursor_walks_reviews_newest_first(self):
+        product = baker.make(Product)
+        reviews = baker.make(Review, product=product, _quantity=5)
+        client = APIClient()
+
+        url = f'/store/products/{product.id}/reviews/?page_size=2'
+        ids = []
+        while url:
+            response = client.get(url)
+            ids += [r['id'] for r in response.data['results']]
+            url = response.data['next']
+
+        assert ids == sorted([r.id for r in reviews], reverse=True)
+
+    def test_first_page_served_from_cache(self, django_assert_num_queries):
+        product = baker.make(Product)
+        baker.make(Review, product=product, _quantity=3)
+        client = APIClient()
+        url = f'/store/products/{product.id}/reviews/'
+        client.get(url)
+
+        # 只剩 ETag 的聚合查詢
+        with django_assert_num_queries(1):
+            response = client.get(url)
+
+        assert len(response.data['results']) == 3
+
+    def test_new_review_invalidates_first_page(self, django_capture_on_commit_callbacks):
+        product = baker.make(Product)
+        client = APIClient()
+        url = f'/store/products/{product.id}/reviews/'
+        client.get(url)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post(url, {'name': 'a', 'description': 'a', 'rating': 4})
+        response = client.get(url)
+
+        assert len(response.data['results']) == 1
+
+
+def make_png(width, height):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (width, height), 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+
+@pytest.mark.django_db
+class TestImageDerivatives:
+    @pytest.fixture(autouse=True)
+    def media(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        settings.IMAGE_DERIVATIVE_WORKERS = 0
+
+    def test_upload_generates_variants_and_srcset(self, django_capture_on_commit_callbacks):
+        product = baker.make(Product)
+        client = APIClient()
+        url = f'/store/products/{product.id}/images/'
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image_id = client.post(url, {'image': make_png(1000, 500)},
+                                   format='multipart').data['id']
+        response = client.get(f'{url}{image_id}/')
+
+        assert (response.data['width'], response.data['height']) == (1000, 500)
+        assert response.data['bytes'] > 0
+        widths = [entry.split()[-1] for entry in response.data['srcset']['webp'].split(', ')]
+        assert widths == ['150w', '400w', '800w']
+
+    def test_variants_shown_in_product_list(self, django_capture_on_commit_callbacks):
+        product = baker.make(Product)
+        with django_capture_on_commit_callbacks(execute=True):
+            ProductImage.objects.create(product=product, image=make_png(300, 300))
+        client = APIClient()
+
+        response = client.get('/store/products/')
+
+        image = response.data['results'][0]['productimage_set'][0]
+        assert re.search(r'/thumb\.[0-9a-f]{16}\.webp 150w$', image['srcset']['webp'])
+
+
+@pytest.mark.django_db
+class TestChunkedImageUpload:
+    @pytest.fixture(autouse=True)
+    def media(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path / 'media'
+        settings.CHUNKED_UPLOAD_DIR = tmp_path / 'partial'
+        settings.IMAGE_DERIVATIVE_WORKERS = 0
+
+    def start(self, client, product, content):
+        return client.post(f'/store/products/{product.id}/images/uploads/', {
+            'filename': 'Photo.PNG', 'size': len(content),
+            'sha256': hashlib.sha256(content).hexdigest()})
+
+    def send(self, client, url, chunk, offset):
+        return client.patch(url, data=chunk, content_type='application/offset+octet-stream',
+                            HTTP_UPLOAD_OFFSET=str(offset))
+
+    def upload(self, client, product, content):
+        upload_id = self.start(client, product, content).data['id']
+        url = f'/store/products/{product.id}/images/uploads/{upload_id}/'
+        self.send(client, url, content, 0)
+        return client.post(f'{url}finalize/')
+
+    def test_resume_and_finalize_creates_image(self):
+        product = baker.make(Product)
+        content = make_png(50, 50).read()
+        client = APIClient()
+
+        response = self.start(client, product, content)
+        assert response.status_code == status.HTTP_201_CREATED
+        url = f'/store/products/{product.id}/images/uploads/{response.data["id"]}/'
+
+        self.send(client, url, content[:100], 0)
+        # 重送同一段會被拒絕，並告知目前 offset
+        response = self.send(client, url, content[:100], 0)
+        assert response.status_code == status.HTTP_409_CONFLICT
+        offset = client.get(url).data['offset']
+        assert offset == 100
+        assert ProductImage.objects.count() == 0
+
+        self.send(client, url, content[offset:], offset)
+        response = client.post(f'{url}finalize/')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        image = ProductImage.objects.get()
+        assert image.image.name == f'product/{hashlib.sha256(content).hexdigest()}.png'
+        assert image.image.read() == content
+
+    def test_same_content_reuses_stored_file(self):
+        product = baker.make(Product)
+        content = make_png(50, 50).read()
+        client = APIClient()
+
+        self.upload(client, product, content)
+        self.upload(client, product, content)
+
+        first, second = ProductImage.objects.all()
+        assert first.image.name != second.image.name
+        # 兩個檔名指向同一個 blob
+        assert os.stat(first.image.path).st_ino == os.stat(second.image.path).st_ino
+
+    def test_checksum_mismatch_return_400(self):
+        product = baker.make(Product)
+        content = make_png(50, 50).read()
+        client = APIClient()
+        upload_id = self.start(client, product, content).data['id']
+        url = f'/store/products/{product.id}/images/uploads/{upload_id}/'
+
+        self.send(client, url, b'x' * len(content), 0)
+        response = client.post(f'{url}finalize/')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert ProductImage.objects.count() == 0
+
+    def test_not_an_image_return_400(self):
+        product = baker.make(Product)
+        client = APIClient()
+
+        response = self.upload(client, product, b'not an image')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_concurrent_chunks_at_same_offset_write_once(self):
+        upload = ChunkedUpload.start(filename='a.bin', size=10, sha256='0' * 64, scope={})
+        reading = threading.Event()
+        release = threading.Event()
+
+        class SlowStream(io.BytesIO):
+            def read(self, size=-1):
+                reading.set()
+                release.wait(5)
+                return super().read(size)
+
+        results = []
+        first = threading.Thread(
+            target=lambda: results.append(upload.append(SlowStream(b'abcde'), 0, 5)))
+        first.start()
+        reading.wait(5)
+        # 第一段拿著鎖時送出同一個 offset 的第二段
+        second = threading.Thread(
+            target=lambda: results.append(upload.append(io.BytesIO(b'abcde'), 0, 5)))
+        second.start()
+        time.sleep(0.1)
+        release.set()
+        first.join()
+        second.join()
+
+        assert sorted(results) == [False, True]
+        assert upload.offset == 5
+
+    def test_deleted_product_stores_nothing(self, settings):
+        product = baker.make(Product)
+        content = make_png(50, 50).read()
+        client = APIClient()
+        upload_id = self.start(client, product, content).data['id']
+        url = f'/store/products/{product.id}/images/uploads/{upload_id}/'
+        self.send(client, url, content, 0)
+
+        product.delete()
+        response = client.post(f'{url}finalize/')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert not os.path.exists(settings.MEDIA_ROOT)
+        assert os.listdir(settings.CHUNKED_UPLOAD_DIR) == []
+
+    def test_cleanup_removes_only_expired_parts(self, settings):
+        product = baker.make(Product)
+        client = APIClient()
+        active = self.start(client, product, b'abc').data['id']
+        expired = self.start(client, product, b'abc').data['id']
+        old = timezone.now().timestamp() - 2 * 60 * 60 * 24
+        for upload_id in (active, expired):
+            os.utime(settings.CHUNKED_UPLOAD_DIR / f'{upload_id}.part', (old, old))
+        cache.delete(f'pyshop:upload:{expired}')
+
+        call_command('cleanup_chunked_uploads', stdout=io.StringIO())
+
+        assert os.listdir(settings.CHUNKED_UPLOAD_DIR) == [f'{active}.part']
+
+
+@pytest.mark.django_db
+class TestContentAddressedStorage:
+    @pytest.fixture(autouse=True)
+    def media(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        settings.IMAGE_DERIVATIVE_WORKERS = 0
+
+    def test_deleted_images_blob_collected_after_last_reference(
+            self, django_capture_on_commit_callbacks):
+        content = make_png(50, 50).read()
+        first, second = (
+            ProductImage.objects.create(product=baker.make(Product),
+                                        image=SimpleUploadedFile('photo.png', content))
+            for _ in range(2))
+        blob = default_storage.blob_path(hashlib.sha256(content).hexdigest())
+        assert os.stat(blob).st_nlink == 3
+
+        with django_capture_on_commit_callbacks(execute=True):
+            first.delete()
+        call_command('gc_media_blobs', grace=0, stdout=io.StringIO())
+
+        assert not os.path.exists(first.image.path)
+        assert os.path.exists(blob)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            second.delete()
+        call_command('gc_media_blobs', grace=0, stdout=io.StringIO())
+
+        assert not os.path.exists(blob)
+
+
+@pytest.mark.django_db
+class TestServeMedia:
+    @pytest.fixture(autouse=True)
+    def media(self, settings, tmp_path):
+        settings.MEDIA_ROOT = tmp_path
+        settings.MEDIA_SERVING = 'django'
+        settings.DEBUG = True
+
+    def test_hashed_name_served_immutable(self):
+        name = default_storage.save('product/photo.png', io.BytesIO(b'0123456789'))
+        client = APIClient()
+
+        response = client.get(f'/media/{name}')
+
+        assert re.search(r'photo\.[0-9a-f]{16}\.png$', name)
+        assert b''.join(response.streaming_content) == b'0123456789'
+        assert 'immutable' in response['Cache-Control']
+
+    def test_range_return_206(self):
+        name = default_storage.save('product/photo.png', io.BytesIO(b'0123456789'))
+        client = APIClient()
+
+        response = client.get(f'/media/{name}', HTTP_RANGE='bytes=2-5')
+
+        assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+        assert response['Content-Range'] == 'bytes 2-5/10'
+        assert b''.join(response.streaming_content) == b'2345'
+
+    def test_accel_mode_offloads_to_nginx(self, settings):
+        settings.MEDIA_SERVING = 'accel'
+        name = default_storage.save('product/photo.png', io.BytesIO(b'0123456789'))
+        client = APIClient()
+
+        response = client.get(f'/media/{name}')
+
+        assert response['X-Accel-Redirect'] == f'/protected-media/{name}'
+        assert response.content == b''
+
+    def test_blobs_not_served(self):
+        default_storage.save('product/photo.png', io.BytesIO(b'0123456789'))
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        client = APIClient()
+
+        blob = f'.blobs/{digest[:2]}/{digest[2:4]}/{digest}'
+
+        for path in (blob, f'./{blob}', f'x/../{blob}', f'product/%2e%2e/{blob}'):
+            response = client.get(f'/media/{path}')
+
+            assert response.status_code == status.HTTP_404_NOT_FOUND, path
+
+    def test_django_mode_off_without_debug(self, settings):
+        settings.DEBUG = False
+        name = default_storage.save('product/photo.png', io.BytesIO(b'0123456789'))
+
+        response = APIClient().get(f'/media/{name}')
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
@@ -0,0 +1,114 @@
+from unittest import mock
+
+import pytest
+from django.core.management import call_command
+from elasticsearch.dsl import Index
+from rest_framework import status
+from rest_framework.test import APIClient
+from model_bakery import baker
+from store.models import Collection, Product
+from store.documents import ProductDocument
+from store.search import ElasticsearchProductSearch, InMemoryProductSearch
+
+
+@pytest.fixture
+def memory_search(settings):
+    settings.PRODUCT_SEARCH_BACKEND = 'memory'
+    InMemoryProductSearch.documents.clear()
+    yield InMemoryProductSearch()
+    InMemoryProductSearch.documents.clear()
+
+
+@pytest.mark.django_db
+class TestSearchProduct:
+    def test_query_filters_and_facets(self, memory_search):
+        fish = baker.make(Collection, title='Fish')
+        toys = baker.make(Collection, title='Toys')
+        baker.make(Product, title='Blue fish', price=50, collection=fish)
+        baker.make(Product, title='Red fish', price=700, collection=fish)
+        baker.make(Product, title='Fish toy', price=50, collection=toys)
+        baker.make(Product, title='Ball', price=50, collection=toys)
+        call_command('reindex_products')
+        client = APIClient()
+
+        response = client.get('/store/products/search/', {
+            'q': 'fish', 'price_lte': 100})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [p['title'] for p in response.data['results']] == ['Blue fish', 'Fish toy']
+        # facet 不受價格篩選影響
+        assert {f['title']: f['count'] for f in response.data['facets']['collections']} == {
+            'Fish': 2, 'Toys': 1}
+        assert response.data['facets']['price_ranges'][0] == {'key': '*-100', 'count': 2}
+
+    def test_collection_filter(self, memory_search):
+        fish = baker.make(Collection, title='Fish')
+        product = baker.make(Product, collection=fish)
+        baker.make(Product)
+        call_command('reindex_products')
+        client = APIClient()
+
+        response = client.get('/store/products/search/', {'collection': fish.id})
+
+        assert [p['id'] for p in response.data['results']] == [product.id]
+
+    def test_product_changes_indexed_on_commit(self, memory_search,
+                                               django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            product = baker.make(Product, title='Old')
+        with django_capture_on_commit_callbacks(execute=True):
+            product.title = 'New'
+            product.save()
+
+        assert memory_search.search('new')['count'] == 1
+
+        with django_capture_on_commit_callbacks(execute=True):
+            product.delete()
+
+        assert memory_search.search()['count'] == 0
+
+    def test_invalid_price_return_400(self, memory_search):
+        client = APIClient()
+
+        response = client.get('/store/products/search/', {'price_gte': 'a'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_offset_past_result_window_return_400(self, memory_search):
+        client = APIClient()
+
+        response = client.get('/store/products/search/', {'offset': 9990, 'size': 20})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestRebuildIndex:
+    def test_rebuild_switches_alias_to_new_index(self):
+        baker.make(Product, _quantity=2)
+        client = mock.MagicMock()
+        client.indices.exists_alias.return_value = True
+        client.indices.get_alias.return_value = {'products-old': {}}
+        bulk_actions = []
+
+        def bulk(client, actions, **kwargs):
+            bulk_actions.extend(actions)
+            return len(bulk_actions), []
+
+        with mock.patch.object(ProductDocument, '_get_connection', return_value=client), \
+                mock.patch.object(Index, 'create') as create, \
+                mock.patch.object(Index, 'refresh'), \
+                mock.patch('django_elasticsearch_dsl.documents.bulk', bulk):
+            ElasticsearchProductSearch().rebuild(
+                Product.objects.select_related('collection').order_by('pk'))
+
+        new_index = bulk_actions[0]['_index']
+        assert new_index.startswith('products-')
+        assert {a['_index'] for a in bulk_actions[:2]} == {new_index}
+        create.assert_called_once()
+        client.indices.update_aliases.assert_called_once_with(actions=[
+            {'add': {'index': new_index, 'alias': 'products'}},
+            {'remove': {'index': 'products-old', 'alias': 'products'}},
+        ])
+        client.indices.delete.assert_called_once_with(
+            index='products-old', ignore_unavailable=True)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework_nested import routers
 from . import views
 
@@ -6,6 +7,8 @@ router = routers.DefaultRouter()
 router.register('collections', views.CollectionViewSet)
 collections_router = routers.NestedDefaultRouter(
     router, 'collections', lookup='collection')
+collections_router.register('products', views.CollectionProductViewSet,
+                            basename='collection-products')
 
 router.register('products', views.ProductViewSet)
 products_router = routers.NestedDefaultRouter(
@@ -15,15 +18,21 @@ products_router.register('images', views.ProductImageViewSet,
 products_router.register('reviews', views.ReviewViewSet,
                          basename='product-reviews')
 
-router.register('carts', views.CartViewSet, basename='carts')
+# CART_BACKEND = 'redis' 時購物車存在 Redis，結帳才寫入資料庫
+if getattr(settings, 'CART_BACKEND', 'sql') == 'redis':
+    cart_viewset, cartitem_viewset = views.RedisCartViewSet, views.RedisCartItemViewSet
+else:
+    cart_viewset, cartitem_viewset = views.CartViewSet, views.CartItemViewSet
+
+router.register('carts', cart_viewset, basename='carts')
 carts_router = routers.NestedDefaultRouter(
     router, 'carts', lookup='cart')
-carts_router.register('cartitem_set', views.CartItemViewSet,
+carts_router.register('cartitem_set', cartitem_viewset,
                       basename='cart-cartitem_set')
 
 router.register('orders', views.OrderViewSet, basename='orders')
 
 router.register('addresses', views.AddressViewSet, basename='addresses')
 
-urlpatterns = router.urls + products_router.urls + \
-    carts_router.urls
+urlpatterns = router.urls + collections_router.urls + \
+    products_router.urls + carts_router.urls
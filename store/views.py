@@ -1,21 +1,90 @@
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from rest_framework.viewsets import ModelViewSet
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, ViewSet
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.decorators import action
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.parsers import MultiPartParser
+from rest_framework.filters import OrderingFilter
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from PIL import Image as PILImage
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, prefetch_related_objects
 
 from .models import Collection, Product, Cart, CartItem, Order, OrderItem, Review, Customer, ProductImage, Address
-from .serializers import CollectionSerializer, ProductSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderCreateSerializer, ProductImageSerializer, AddressSerializer, CustomerSerializer
+from .serializers import CollectionSerializer, CollectionExpandSerializer, ProductSerializer, ProductFilterSerializer, ReviewSerializer, CartSerializer, CartSummarySerializer, CartItemSerializer, CartItemBulkSerializer, OrderSerializer, OrderListSerializer, OrderCreateSerializer, ProductImageSerializer, ProductSearchSerializer, AddressSerializer, CustomerSerializer
+from .pagination import KeysetPagination, ReviewPagination
+from .filters import QueryParamFilter
+from .caching import VersionedCacheFirstPageMixin, VersionedCacheRetrieveMixin
+from .conditional import ConditionalGetMixin
+from .inventory import InsufficientInventory
+from .carts import get_cart_store
+from .search import get_search_backend
+from .catalog import FORMATS, ProductImporter, export_rows, guess_format, is_utf8, read_rows, render_rows, text_stream
 from pyshop.permission import IsAdminOrReadOnly
+from pyshop.uploads import ChunkedUploadMixin
 
 
-class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.prefetch_related(
-        "product_set__productimage_set"  # 預載該 Collection 內的產品與產品圖片
-    )
-    serializer_class = CollectionSerializer
+class CollectionViewSet(ConditionalGetMixin, VersionedCacheRetrieveMixin, ModelViewSet):
+    queryset = Collection.objects.all()
+    cache_name = 'collection'
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    # ?expand=products 時每個 collection 最多內嵌幾個產品
+    expand_products_limit = 20
+
+    def expand_products(self):
+        expand = self.request.query_params.get('expand', '')
+        return 'products' in expand.split(',')
+
+    def get_queryset(self):
+        # 預設只做一次 COUNT 聚合查詢，不載入任何產品
+        queryset = Collection.objects.annotate(products_count=Count('product'))
+        if self.expand_products():
+            # 切片的 Prefetch 會用 window function，每個 collection 只取前 N 個產品
+            products = Product.objects.prefetch_related(
+                'productimage_set').order_by('title', 'id')
+            queryset = queryset.prefetch_related(Prefetch(
+                'product_set',
+                queryset=products[:self.expand_products_limit],
+                to_attr='preview_products'
+            ))
+        return queryset
+
+    def get_serializer_class(self):
+        if self.expand_products():
+            return CollectionExpandSerializer
+        return CollectionSerializer
+
+    # 列表與單筆的 ETag 用 collection 版本號（產品異動時也會 bump）
+    page_version_name = 'collection'
+
+    # 取不到版本號時的備案（見 ConditionalGetMixin.get_detail_validators）
+    def get_validators(self):
+        validators = Collection.objects.filter(pk=self.kwargs['pk']).aggregate(
+            last_modified=Max('update_date'),
+            count=Count('id', distinct=True),
+            products_modified=Max('product__update_date'),
+            products_count=Count('product'),
+        )
+        if not validators['count']:
+            return None
+        return validators
+
+    def get_page_validators(self, page):
+        validators = super().get_page_validators(page)
+        validators['products_count'] = [obj.products_count for obj in page]
+        return validators
+
+
+class CollectionProductViewSet(ReadOnlyModelViewSet):
+    serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return Product.objects.prefetch_related('productimage_set').filter(
+            collection_id=self.kwargs['collection_pk'])
 
 
 def destroy(self, request, *args, **kwargs):
@@ -26,10 +95,62 @@ def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, VersionedCacheRetrieveMixin, ModelViewSet):
     queryset = Product.objects.prefetch_related('productimage_set').all()
+    cache_name = 'product'
     serializer_class = ProductSerializer
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = KeysetPagination
+    filter_backends = [QueryParamFilter, OrderingFilter]
+    filter_serializer_class = ProductFilterSerializer
+    # 每個排序欄位都有對應的 (欄位, id) 索引，keyset 分頁才不用 filesort
+    ordering_fields = ['title', 'price', 'update_date']
+
+    page_version_name = 'product'
+
+    # 取不到版本號時的備案（見 ConditionalGetMixin.get_detail_validators）
+    def get_validators(self):
+        validators = Product.objects.filter(pk=self.kwargs['pk']).aggregate(
+            last_modified=Max('update_date'), count=Count('id'))
+        if not validators['count']:
+            return None
+        return validators
+
+    @action(detail=False)
+    def search(self, request):
+        params = ProductSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(get_search_backend().search(**params.validated_data))
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def export(self, request):
+        # 不能用 ?format=，那是 DRF 指定 renderer 的參數
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in FORMATS:
+            return Response({'error': f'file_format 必須是 {FORMATS}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            render_rows(export_rows(), file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[permissions.IsAdminUser],
+            parser_classes=[MultiPartParser])
+    def import_products(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': '請上傳 file'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('file_format') or guess_format(upload.name)
+        if file_format not in FORMATS:
+            return Response({'error': f'file_format 必須是 {FORMATS}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if not is_utf8(upload.file):
+            return Response({'error': '檔案必須是 UTF-8 編碼'}, status=status.HTTP_400_BAD_REQUEST)
+        result = ProductImporter().run(read_rows(text_stream(upload.file), file_format))
+        return Response(result)
 
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
@@ -38,23 +159,63 @@ class ProductViewSet(ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ProductImageViewSet(ModelViewSet):
+class ProductChildConditionalGetMixin(ConditionalGetMixin):
+    # 圖片、評論異動時會更新所屬 Product 的 update_date（見 store.signals）
+    def get_validators(self):
+        return Product.objects.filter(pk=self.kwargs['product_pk']).aggregate(
+            last_modified=Max('update_date'), count=Count('id'))
+
+
+class ProductImageViewSet(ProductChildConditionalGetMixin, ChunkedUploadMixin, ModelViewSet):
+    upload_to = 'product/'
+    max_upload_size = 20 * 1024 * 1024
+
     def get_queryset(self):
         return ProductImage.objects.filter(product_id=self.kwargs['product_pk'])
 
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
 
+    def validate_upload(self, upload):
+        try:
+            with PILImage.open(upload.path) as image:
+                image.verify()
+        except Exception:
+            raise ValidationError({'image': '不是有效的圖片'})
+
+    def get_upload_parent(self):
+        return get_object_or_404(Product, pk=self.kwargs['product_pk'])
+
+    def create_from_upload(self, name, upload, parent):
+        return ProductImage.objects.create(product=parent, image=name)
+
     serializer_class = ProductImageSerializer
 
 
-class ReviewViewSet(ModelViewSet):
+class ReviewViewSet(ProductChildConditionalGetMixin, VersionedCacheFirstPageMixin, ModelViewSet):
+    pagination_class = ReviewPagination
+    cache_name = 'reviews'
+    cache_parent_kwarg = 'product_pk'
+
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
 
     def get_serializer_context(self):
         return {'product_id': self.kwargs['product_pk']}
 
+    # Product 的評論統計在 signal 裡更新，跟評論同一個交易
+    @transaction.atomic
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+
     serializer_class = ReviewSerializer
 
 
@@ -66,14 +227,30 @@ class CartViewSet(ModelViewSet):
         user = self.request.user
         if not user.is_authenticated:
             return Cart.objects.none()
-        return Cart.objects.prefetch_related('cartitem_set__product').filter(user=user)
+        queryset = Cart.objects.with_totals().filter(user=user)
+        if self.action == 'summary':
+            return queryset
+        return queryset.prefetch_related(Prefetch(
+            'cartitem_set',
+            queryset=CartItem.objects.select_related('product').with_line_total()
+        ))
+
+    def get_serializer_class(self):
+        if self.action == 'summary':
+            return CartSummarySerializer
+        return CartSerializer
+
+    @action(detail=True)
+    def summary(self, request, pk=None):
+        serializer = self.get_serializer(self.get_object())
+        return Response(serializer.data)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
     def create(self, request, *args, **kwargs):
         user = request.user
-        existing_cart = Cart.objects.filter(user=user).first()
+        existing_cart = self.get_queryset().first()
         if existing_cart:
             serializer = self.get_serializer(existing_cart)
             return Response(serializer.data, status=status.HTTP_200_OK)
@@ -98,10 +275,177 @@ class CartItemViewSet(ModelViewSet):
         if not cart_qs.exists():
             raise PermissionDenied("您無權存取此購物車")
 
-        return CartItem.objects.filter(cart_id=cart_id).select_related('product')
+        return CartItem.objects.filter(cart_id=cart_id).select_related('product').with_line_total()
 
     serializer_class = CartItemSerializer
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk=None):
+        # 購物車權限只檢查一次
+        queryset = self.get_queryset()
+        serializer = CartItemBulkSerializer(
+            data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        product_ids = serializer.save()
+
+        cartitem_set = queryset.filter(product_id__in=product_ids)
+        return Response(CartItemSerializer(cartitem_set, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+
+class RedisCartMixin:
+    """
+    CART_BACKEND = 'redis' 時購物車改由 RedisCartStore 處理。
+    未登入也能 POST carts/ 建立購物車，回應裡的 token 放在 X-Cart-Token header 存取；
+    登入後帶著 token POST carts/ {"cart_id": ...} 會把它併進自己的購物車，結帳仍需登入
+    """
+    permission_classes = [permissions.AllowAny]
+    cart_token_header = 'X-Cart-Token'
+
+    def get_cart_store(self):
+        return get_cart_store()
+
+    def has_cart_token(self, store, cart_id):
+        token = self.request.headers.get(self.cart_token_header)
+        return bool(token) and store.check_token(cart_id, token)
+
+    def check_cart_owner(self, store, cart_id):
+        user = self.request.user
+        if user.is_authenticated and store.get_owner(cart_id) == str(user.id):
+            return
+        if not self.has_cart_token(store, cart_id):
+            raise PermissionDenied("您無權存取此購物車")
+
+    def load_items(self, store, cart_id):
+        items = store.items(cart_id)
+        products = Product.objects.in_bulk([i.product_id for i in items])
+        # 產品已被刪除的品項不顯示
+        items = [i for i in items if i.product_id in products]
+        for item in items:
+            item.product = products[item.product_id]
+        return items
+
+    def serialize_cart(self, store, cart_id):
+        items = self.load_items(store, cart_id)
+        return {
+            'id': cart_id,
+            'user': self.request.user.id,
+            'cartitem_set': CartItemSerializer(items, many=True).data,
+            'total_price': sum(i.quantity * i.product.price for i in items),
+        }
+
+
+class RedisCartViewSet(RedisCartMixin, ViewSet):
+    def list(self, request):
+        store = self.get_cart_store()
+        if not request.user.is_authenticated:
+            # 匿名購物車只能用 id + token 取得
+            return Response([])
+        cart_id = store.get_user_cart(request.user.id)
+        if cart_id is None:
+            return Response([])
+        return Response([self.serialize_cart(store, cart_id)])
+
+    def create(self, request):
+        store = self.get_cart_store()
+        if not request.user.is_authenticated:
+            cart_id, token = store.create_anonymous()
+            return Response({**self.serialize_cart(store, cart_id), 'token': token},
+                            status=status.HTTP_201_CREATED)
+
+        anonymous_cart_id = str(request.data.get('cart_id') or '')
+        if anonymous_cart_id:
+            if not self.has_cart_token(store, anonymous_cart_id):
+                raise PermissionDenied("您無權存取此購物車")
+            cart_id = store.claim(anonymous_cart_id, request.user.id)
+            return Response(self.serialize_cart(store, cart_id))
+
+        cart_id, created = store.create(request.user.id)
+        return Response(self.serialize_cart(store, cart_id),
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def retrieve(self, request, pk=None):
+        store = self.get_cart_store()
+        self.check_cart_owner(store, pk)
+        return Response(self.serialize_cart(store, pk))
+
+    def destroy(self, request, pk=None):
+        store = self.get_cart_store()
+        self.check_cart_owner(store, pk)
+        store.delete(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class RedisCartItemViewSet(RedisCartMixin, ViewSet):
+    def get_cart_id(self, store):
+        cart_id = self.kwargs['cart_pk']
+        self.check_cart_owner(store, cart_id)
+        return cart_id
+
+    def get_item(self, store, cart_id, pk):
+        for item in self.load_items(store, cart_id):
+            if str(item.product_id) == str(pk):
+                return item
+        raise NotFound()
+
+    def list(self, request, cart_pk=None):
+        store = self.get_cart_store()
+        items = self.load_items(store, self.get_cart_id(store))
+        return Response(CartItemSerializer(items, many=True).data)
+
+    def retrieve(self, request, cart_pk=None, pk=None):
+        store = self.get_cart_store()
+        item = self.get_item(store, self.get_cart_id(store), pk)
+        return Response(CartItemSerializer(item).data)
+
+    def create(self, request, cart_pk=None):
+        store = self.get_cart_store()
+        cart_id = self.get_cart_id(store)
+        serializer = CartItemSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product = serializer.validated_data['product']
+        store.add(cart_id, product.id,
+                  serializer.validated_data['quantity'], product.price)
+        item = self.get_item(store, cart_id, product.id)
+        return Response(CartItemSerializer(item).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, cart_pk=None):
+        store = self.get_cart_store()
+        cart_id = self.get_cart_id(store)
+        serializer = CartItemBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+        store.add_many(cart_id, [
+            (line['product'].pk, line['quantity'], line['product'].price)
+            for line in items
+        ])
+
+        product_ids = {line['product'].pk for line in items}
+        cartitem_set = [i for i in self.load_items(store, cart_id)
+                        if i.product_id in product_ids]
+        return Response(CartItemSerializer(cartitem_set, many=True).data,
+                        status=status.HTTP_201_CREATED)
+
+    def update(self, request, cart_pk=None, pk=None):
+        store = self.get_cart_store()
+        cart_id = self.get_cart_id(store)
+        serializer = CartItemSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        quantity = serializer.validated_data.get('quantity')
+        if quantity is not None and not store.set_quantity(cart_id, pk, quantity):
+            raise NotFound()
+        return Response(CartItemSerializer(self.get_item(store, cart_id, pk)).data)
+
+    def partial_update(self, request, cart_pk=None, pk=None):
+        return self.update(request, cart_pk=cart_pk, pk=pk)
+
+    def destroy(self, request, cart_pk=None, pk=None):
+        store = self.get_cart_store()
+        if not store.remove(self.get_cart_id(store), pk):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
 class OrderViewSet(ModelViewSet):
     serializer_class = OrderSerializer
@@ -110,13 +454,34 @@ class OrderViewSet(ModelViewSet):
         user = self.request.user
         if not user.is_authenticated:
             return Order.objects.none()
+        if self.action == 'list':
+            # 列表只讀 store_order 一張表
+            return Order.objects.filter(customer_id=user.id)
         return Order.objects.prefetch_related('orderitem_set__product').select_related('shipping_address').filter(customer_id=user.id)
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return OrderSerializer
+
     def create(self, request, *args, **kwargs):
         create_serializer = OrderCreateSerializer(
             data=request.data, context={'customer_id': request.user.id})
         create_serializer.is_valid(raise_exception=True)
-        order = create_serializer.save()
+        try:
+            order = create_serializer.save()
+        except InsufficientInventory as e:
+            return Response({'error': '庫存不足', 'inventory': e.shortfalls},
+                            status=status.HTTP_409_CONFLICT)
+
+        # 回應需要的資料一次預載好，查詢數不隨購物車大小增加
+        prefetch_related_objects(
+            [order],
+            Prefetch('orderitem_set',
+                     queryset=OrderItem.objects.select_related('product')),
+            'orderitem_set__product__productimage_set',
+            'shipping_address',
+        )
 
         response_serializer = self.get_serializer(order)
         headers = self.get_success_headers(response_serializer.data)